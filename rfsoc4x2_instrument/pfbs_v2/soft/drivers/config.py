@@ -0,0 +1,164 @@
+"""
+Board-independent configuration and frequency planning.
+Only depends on numpy, so exported configurations (see TopSoc.export_config) can be used without pynq.
+"""
+import numpy as np
+import json
+
+class QickConfig():
+    """Uses the QICK configuration to convert frequencies and clock delays.
+    If running on the QICK, you don't need to use this class - the QickSoc class has all of the same methods.
+    If running remotely, you may want to initialize a QickConfig from a JSON file.
+
+    Parameters
+    ----------
+    cfg : dict or str
+        config dictionary, or path to JSON file
+
+    Returns
+    -------
+
+    """
+
+    def __init__(self, cfg=None):
+        if isinstance(cfg, str):
+            with open(cfg) as f:
+                self._cfg = json.load(f)
+        elif cfg is not None:
+            self._cfg = cfg
+
+    def __str__(self):
+        return self.description()
+
+    def __getitem__(self, key):
+        return self._cfg[key]
+
+    def __setitem__(self, key, val):
+        self._cfg[key] = val
+
+    def save(self, path):
+        """
+        Writes the configuration dictionary to a JSON file, which can be loaded with QickConfig(path).
+        """
+        with open(path, 'w') as f:
+            json.dump(self._cfg, f, indent=1, default=json_default)
+
+    # Offline frequency planning.
+    # The chain arguments are chain dictionaries of an exported configuration (see TopSoc.export_config),
+    # e.g. cfg['dual'][0]['analysis']. All methods accept scalars or arrays.
+    def check_freqs(self, chain, f):
+        fmix = abs(chain['mixer']['freq'])
+        fs = chain['pfb_cfg']['fs']
+        f = np.asarray(f)
+
+        if not np.all(((fmix-fs/2) < f) & (f < (fmix+fs/2))):
+            raise ValueError("Frequency values out of allowed range [%f,%f]" % (fmix-fs/2,fmix+fs/2))
+        return f - fmix
+
+    def freq2ch(self, chain, f):
+        """
+        PFB channels of the frequencies f (MHz).
+        """
+        f_ = self.check_freqs(chain, f)
+        k = np.round(f_/chain['pfb_cfg']['fc']).astype(int)
+        return np.mod(k, chain['pfb_cfg']['N'])
+
+    def ch2freq(self, chain, ch):
+        """
+        Center frequencies (MHz) of the PFB channels ch.
+        """
+        N = chain['pfb_cfg']['N']
+        ch = np.asarray(ch)
+        k = np.where(ch >= N/2, ch - N, ch)
+        return k*chain['pfb_cfg']['fc'] + abs(chain['mixer']['freq'])
+
+    def fq(self, chain, f):
+        """
+        Frequencies f (MHz) quantized to the DDS resolution of the chain.
+        """
+        return np.round(np.asarray(f)/chain['fr'])*chain['fr']
+
+    def freq2dds(self, chain, f):
+        """
+        PFB channels and DDS frequencies (MHz) to generate/demodulate the frequencies f (MHz).
+        """
+        k = self.freq2ch(chain, f)
+        return k, self.check_freqs(chain, f) - (self.ch2freq(chain, k) - abs(chain['mixer']['freq']))
+
+    # Offline tone/sweep planning on paired chains, e.g. cfg['dual'][0] (see KidsChain).
+    def pair_fr(self, pair):
+        # Frequency resolution of a paired chain (the coarser of both DDSs).
+        return max(pair['analysis']['fr'], pair['synthesis']['fr'])
+
+    def plan_windows(self, pair, fstart, fend, overlap=1, frac=0.8):
+        """
+        Mixer windows to sweep [fstart,fend] with a paired chain, as KidsChain.plan_windows on the board.
+
+        :return: list of (flow, fhigh, fmix) tuples.
+        :rtype: list
+        """
+        bw = frac*min(pair['analysis']['pfb_cfg']['fs'], pair['synthesis']['pfb_cfg']['fs'])
+        fr = self.pair_fr(pair)
+        return plan_windows(fstart, fend, bw, pair['synthesis']['mixer']['freq'], lambda f: np.round(f/fr)*fr, overlap=overlap)
+
+    def plan_tones(self, pair, f, fmix=None):
+        """
+        Tone program of a paired chain: quantized frequencies and the synthesis PFB channels and DDS frequencies
+        that generate them. Only this table needs to be sent to the board.
+
+        :param f: frequencies (MHz).
+        :type f: array
+        :param fmix: mixer frequency (MHz) the tones are planned for (e.g. from plan_windows). Defaults to the
+        exported mixer frequency.
+        :type fmix: float
+        :return: structured array with fields f, ch and dds_freq (MHz), and the mixer frequency.
+        :rtype: (array, float)
+        """
+        chain = pair['synthesis']
+        if fmix is not None:
+            chain = dict(chain, mixer=dict(chain['mixer'], freq=fmix))
+
+        fq = np.atleast_1d(self.fq(dict(chain, fr=self.pair_fr(pair)), f))
+        k, fdds = self.freq2dds(chain, fq)
+
+        program = np.zeros(len(fq), dtype=[('f', np.float64), ('ch', int), ('dds_freq', np.float64)])
+        program['f'] = fq
+        program['ch'] = k
+        program['dds_freq'] = fdds
+        return program, chain['mixer']['freq']
+
+def plan_windows(fstart, fend, bw, fmix, fq, overlap=1):
+    """
+    Splits [fstart,fend] into windows of bw MHz overlapping by overlap MHz, centered on mixer frequencies
+    quantized with fq. Windows start from the end closest to the current mixer frequency fmix, so the first
+    window can reuse it and every other window needs a single retune.
+
+    :return: list of (flow, fhigh, fmix) tuples.
+    :rtype: list
+    """
+    if bw <= overlap:
+        raise ValueError("overlap = %f MHz must be smaller than the window bandwidth %f MHz" % (overlap, bw))
+
+    # Windows in frequency order.
+    windows = []
+    flow = fstart
+    while True:
+        fhigh = min(flow + bw, fend)
+        windows.append((flow, fhigh, fq((flow + fhigh)/2)))
+        if fhigh >= fend:
+            break
+        flow = fhigh - overlap
+
+    # Start from the end closest to the current mixer frequency.
+    if abs(windows[-1][2] - fmix) < abs(windows[0][2] - fmix):
+        windows.reverse()
+
+    return windows
+
+def json_default(obj):
+    # numpy scalars and arrays are not JSON serializable.
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
@@ -0,0 +1,135 @@
+"""
+Software model of the AxisKidsimV3 resonator data path.
+It only depends on numpy, so it can be used offline to predict the emulator response.
+"""
+import numpy as np
+
+class KidsimModel:
+    """
+    Numpy model of the KIDSIM data path of each channel:
+
+    * DDS: on a trigger (sample 0) the frequency word jumps to dds_freq + dds_bval and, every dds_wait+1
+      samples, moves back towards dds_freq by dds_slope for dds_steps steps, then holds. The driver sets
+      dds_bval from sweep_freq and dds_slope = dds_bval/dds_steps, so the recovery ends at dds_freq.
+    * IIR: the input is moved to baseband with the DDS, filtered with
+      y[n] = c1*y[n-1] + g*(x[n] - c0*x[n-1]) and moved back with the same DDS.
+    * Output selection: resonator (0), dds (1), input (2) or zero (3).
+
+    The model is fed with the quantized register words of AxisKidsimV3.resonator_regs() (or
+    set_resonator_regs()), one resonator per row, and is vectorized across channels and time.
+    """
+    # Register word columns (see AxisKidsimV3.REG_WORDS).
+    REG_WORDS = ['dds_bval', 'dds_slope', 'dds_steps', 'dds_wait', 'dds_freq', 'iir_c0', 'iir_c1', 'iir_g', 'outsel', 'punct_id', 'addr']
+
+    def __init__(self, fs, B_DDS=16, B_COEF=16):
+        """
+        :param fs: DDS sampling frequency in MHz (PFB channel sampling frequency).
+        :type fs: float
+        """
+        self.fs = fs
+        self.B_DDS = B_DDS
+        self.B_COEF = B_COEF
+
+    @staticmethod
+    def signed(x):
+        # Two's complement 32-bit words.
+        x = np.asarray(x, dtype=np.int64) & 0xFFFFFFFF
+        return np.where(x >= 2**31, x - 2**32, x)
+
+    def decode(self, regs):
+        """
+        Decodes register words into a dictionary of per-resonator arrays.
+        """
+        regs = np.atleast_2d(regs)
+        d = {k : self.signed(regs[:,i]) for i, k in enumerate(self.REG_WORDS)}
+        for k in ['iir_c0', 'iir_c1', 'iir_g']:
+            d[k] = d[k]/2**(self.B_COEF-1)
+        return d
+
+    def dds_words(self, regs, nsamp):
+        """
+        Frequency words of the DDS of each resonator after a trigger at sample 0, shape (n, nsamp).
+        """
+        d = self.decode(regs)
+        t = np.arange(nsamp)
+        step = np.minimum(t[None,:]//(d['dds_wait'][:,None]+1), d['dds_steps'][:,None])
+        return d['dds_freq'][:,None] + d['dds_bval'][:,None] - step*d['dds_slope'][:,None]
+
+    def dds_phase(self, regs, nsamp):
+        """
+        Phase (radians) of the DDS of each resonator, shape (n, nsamp).
+        """
+        w = self.dds_words(regs, nsamp)
+        acc = np.mod(np.cumsum(w, axis=1) - w, 2**self.B_DDS)
+        return 2*np.pi*acc/2**self.B_DDS
+
+    def iir(self, x, c0, c1, g):
+        """
+        First order IIR y[n] = c1*y[n-1] + g*(x[n] - c0*x[n-1]) along the last axis, with zero initial state.
+        c0 is the zero and c1 the pole, so with g = (1+c1)/(1+c0) the gain is 1 far from resonance (z = -1)
+        and g*(1-c0)/(1-c1) at resonance (z = 1), a dip for c0 > c1.
+        The recursion is solved in closed form over blocks, so the cost is a few numpy operations per block.
+        """
+        x = np.atleast_2d(x)
+        c0 = np.asarray(c0, dtype=np.float64).reshape(-1,1)
+        c1 = np.asarray(c1, dtype=np.float64).reshape(-1,1)
+        g  = np.asarray(g , dtype=np.float64).reshape(-1,1)
+
+        # Feed-forward part (zero).
+        u = g*x
+        u[:,1:] -= g*c0*x[:,:-1]
+
+        # Feedback part (pole).
+        a = np.abs(c1)
+        a = a[a > 0]
+        if len(a) == 0:
+            return u
+        # Keep c1^-B well inside the float64 range.
+        B = int(max(1, min(x.shape[1], 200/max(1e-12, -np.log10(a.min())))))
+        p  = c1**np.arange(1, B+1)[None,:]
+        ip = np.where(c1 != 0, c1, 1.0)**-np.arange(1, B+1)[None,:]
+
+        y = np.empty(u.shape, dtype=np.complex128)
+        y0 = np.zeros((u.shape[0],1), dtype=np.complex128)
+        for i in range(0, u.shape[1], B):
+            ub = u[:,i:i+B]
+            nb = ub.shape[1]
+            # y[k] = c1^k*y0 + sum_{j<=k} c1^(k-j)*u[j], k = 1..nb.
+            yb = p[:,:nb]*(y0 + np.cumsum(ub*ip[:,:nb], axis=1))
+            yb = np.where(c1 != 0, yb, ub)
+            y[:,i:i+nb] = yb
+            y0 = yb[:,-1:]
+        return y
+
+    def run(self, regs, x=None, nsamp=None):
+        """
+        Predicts the output I/Q traces of each resonator.
+
+        :param regs: register words, shape (n, 11).
+        :type regs: array
+        :param x: complex input of each channel, shape (n, nsamp) or (nsamp,). If None, a constant
+        unit input (a tone at the channel center) of nsamp samples is used.
+        :type x: array
+        :param nsamp: number of samples when x is None.
+        :type nsamp: int
+        :return: time (us) and complex output, shape (n, nsamp).
+        :rtype: (array, array)
+        """
+        d = self.decode(regs)
+        n = len(d['outsel'])
+        if x is None:
+            x = np.ones((n, nsamp), dtype=np.complex128)
+        else:
+            x = np.broadcast_to(np.asarray(x, dtype=np.complex128), (n, np.shape(x)[-1]))
+        nsamp = x.shape[1]
+
+        # Move to baseband, filter and move back.
+        dds = np.exp(1j*self.dds_phase(regs, nsamp))
+        res = self.iir(x*np.conj(dds), d['iir_c0'], d['iir_c1'], d['iir_g'])*dds
+
+        # Output selection.
+        sel = d['outsel'][:,None]
+        y = np.where(sel == 0, res, np.where(sel == 1, dds, np.where(sel == 2, x, 0)))
+
+        t = np.arange(nsamp)/self.fs
+        return t, y
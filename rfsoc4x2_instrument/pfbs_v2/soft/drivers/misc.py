@@ -1,6 +1,7 @@
 import numpy as np
 from pynq.buffer import allocate
 from .ip import SocIp
+from .kidsim import KidsimModel
 import time
 
 class MrBufferEt(SocIp):
@@ -717,6 +718,12 @@ class AxisKidsimV3(SocIp):
 
     # Coefficient/gain bits.
     B_COEF = 16
+
+    # Output selection register values (any other selection maps to 3).
+    OUTSEL = {'resonator' : 0, 'dds' : 1, 'input' : 2}
+
+    # Resonator register words, in set_registers() order (registers 0 to 10).
+    REG_WORDS = ['dds_bval', 'dds_slope', 'dds_steps', 'dds_wait', 'dds_freq', 'iir_c0', 'iir_c1', 'iir_g', 'outsel', 'punct_id', 'addr']
     
     def __init__(self, description):
         # Initialize ip
@@ -729,11 +736,24 @@ class AxisKidsimV3(SocIp):
         self.L      = int(description['parameters']['L'])
         self.NCH    = 256
         self.NPUNCT = int(self.NCH/self.L)
+
+        # Shadow of the programmed resonator words: lane -> words 0 to 9 of REG_WORDS.
+        # The hardware keeps one configuration per lane (punct_id is a data word of it), so the shadow is
+        # keyed by lane only. Lanes are only skipped once they have been written by this driver.
+        self.dict = {}
+        self.dict['shadow'] = {}
+        self.dict['writes'] = {'performed' : 0, 'elided' : 0}
         
     def configure(self, fs):
         fs_hz = fs*1000*1000
         self.FS_DDS = fs_hz
         self.DF_DDS = self.FS_DDS/2**self.B_DDS
+
+    def model(self):
+        """
+        Software model of this block (see KidsimModel), fed with the register words of resonator_regs().
+        """
+        return KidsimModel(self.FS_DDS/1e6, B_DDS=self.B_DDS, B_COEF=self.B_COEF)
         
     def set_registers(self, dds_bval, dds_slope, dds_steps, dds_wait, dds_freq, iir_c0, iir_c1, iir_g, outsel, punct_id, addr):
         self.dds_bval_reg  = dds_bval
@@ -751,6 +771,11 @@ class AxisKidsimV3(SocIp):
         # Write enable pulse.
         self.we_reg     = 1
         self.we_reg     = 0
+
+        # Update shadow.
+        words = (dds_bval, dds_slope, dds_steps, dds_wait, dds_freq, iir_c0, iir_c1, iir_g, outsel, punct_id)
+        self.dict['shadow'][int(addr)] = tuple(int(x) & 0xFFFFFFFF for x in words)
+        self.dict['writes']['performed'] += 1
         
     
     def set_resonator(self, config, verbose = False):
@@ -831,6 +856,12 @@ class AxisKidsimV3(SocIp):
             print('{}: nstep      = {}'.format(self.__class__.__name__,config['nstep']))
     
     def set_resonator_regs(self, config, verbose = False):
+        # Set Registers.
+        self.set_registers(*self.config2regs(config, verbose))
+
+    def config2regs(self, config, verbose = False):
+        # Register words of a configuration built by set_resonator_config(), in REG_WORDS order.
+
         # DDS Section Registers.
         dds_bval_reg  = config['dds_bval_reg']
         dds_slope_reg = config['dds_slope_reg']
@@ -868,32 +899,160 @@ class AxisKidsimV3(SocIp):
             print('sel = {}, punct_id = {}, addr = {}'
                   .format(outsel_reg, punct_id_reg, addr_reg))
 
-        # Set Registers.
-        self.set_registers(
-            dds_bval_reg ,
-            dds_slope_reg,
-            dds_steps_reg,
-            dds_wait_reg ,
-            dds_freq_reg ,
-            iir_c0_reg   ,
-            iir_c1_reg   ,
-            iir_g_reg    ,
-            outsel_reg   ,
-            punct_id_reg ,
-            addr_reg     )                        
+        return [dds_bval_reg ,
+                dds_slope_reg,
+                dds_steps_reg,
+                dds_wait_reg ,
+                dds_freq_reg ,
+                iir_c0_reg   ,
+                iir_c1_reg   ,
+                iir_g_reg    ,
+                outsel_reg   ,
+                punct_id_reg ,
+                addr_reg     ]
         
 
+    def resonator_regs(self, channel, dds_freq=0, sweep_freq=0.9, sweep_time=100, iir_c0=0.99, iir_c1=0.8, sel='resonator', dds_wait=1, verbose = False):
+        """
+        Vectorized version of the register computation of set_resonator_config() and set_resonator_regs().
+        All arguments are scalars or arrays broadcast to the number of channels.
+
+        :param channel: PFB channels.
+        :type channel: array
+        :param dds_freq: DDS frequencies in MHz.
+        :param sweep_freq: sweep frequencies in MHz.
+        :param sweep_time: sweep times in us.
+        :param sel: output selection ("resonator", "dds", "input") or register values.
+        :return: (n, 11) array of register words, columns in REG_WORDS order.
+        :rtype: array
+        """
+        channel = np.atleast_1d(np.asarray(channel, dtype=np.int64))
+        n = len(channel)
+        def vec(x, dtype=np.float64):
+            return np.broadcast_to(np.asarray(x, dtype=dtype), (n,))
+
+        if np.any((channel < 0) | (channel >= self.NCH)):
+            raise ValueError("%s: channels must be within [0,%d]" % (self.fullpath, self.NCH-1))
+
+        dds_wait    = vec(dds_wait, np.int64)
+        sweep_time  = vec(sweep_time)
+        iir_c0      = vec(iir_c0)
+        iir_c1      = vec(iir_c1)
+        iir_g       = (1+iir_c1)/(1+iir_c0)
+
+        # Output selection.
+        sel = np.asarray(sel)
+        if sel.dtype.kind in 'iu':
+            outsel = vec(sel, np.int64)
+        else:
+            outsel = vec([self.OUTSEL.get(str(x), 3) for x in np.atleast_1d(sel)], np.int64)
+
+        # Number of steps.
+        ts = 1/(self.FS_DDS/1e6)
+        nstep = np.floor(sweep_time/((dds_wait+1)*ts)).astype(np.int64)
+        if np.any(nstep < 1):
+            raise ValueError("%s: sweep_time too short for dds_wait" % (self.fullpath))
+
+        # Sanity check (slope = 0).
+        bval  = np.round(vec(sweep_freq)*1e6/self.DF_DDS).astype(np.int64)
+        slope = np.round(bval/nstep).astype(np.int64)
+        fix = slope < 1
+        if np.any(fix):
+            slope[fix] = 1
+            nstep[fix] = bval[fix]
+            print('{}: Updated sweep_time of {} resonators. Try increasing dds_wait.'
+                  .format(self.__class__.__name__, np.count_nonzero(fix)))
+
+        regs = np.empty((n, len(self.REG_WORDS)), dtype=np.int64)
+        regs[:,0]  = bval
+        regs[:,1]  = slope
+        regs[:,2]  = nstep
+        regs[:,3]  = dds_wait
+        regs[:,4]  = np.round(vec(dds_freq)*1e6/self.DF_DDS)
+        regs[:,5]  = np.round(iir_c0*(2**(self.B_COEF-1)))
+        regs[:,6]  = np.round(iir_c1*(2**(self.B_COEF-1)))
+        regs[:,7]  = np.round(iir_g*(2**(self.B_COEF-1)))
+        regs[:,8]  = outsel
+        regs[:,9]  = channel // self.L
+        regs[:,10] = channel % self.L
+
+        if verbose:
+            print('{}: {} resonators'.format(self.__class__.__name__, n))
+
+        # Negative values are written as two's complement.
+        return (regs & 0xFFFFFFFF).astype(np.uint32)
+
+    def write_regs(self, regs, force = False):
+        """
+        Writes register words computed by resonator_regs(), one resonator per row.
+        Rows whose words (punct_id included) match the shadow of their lane are skipped unless force is True.
+
+        :return: number of rows written.
+        :rtype: int
+        """
+        arr = self.mmio.array
+        we = self.REGISTERS['we_reg']
+        shadow = self.dict['shadow']
+        nwr = 0
+        for row in np.atleast_2d(regs).tolist():
+            key = row[10]
+            words = tuple(row[:10])
+            if not force and shadow.get(key) == words:
+                continue
+
+            for i in range(len(row)):
+                arr[i] = row[i]
+
+            # Write enable pulse.
+            arr[we] = 1
+            arr[we] = 0
+
+            shadow[key] = words
+            nwr += 1
+
+        self.dict['writes']['performed'] += nwr
+        self.dict['writes']['elided'] += len(np.atleast_2d(regs)) - nwr
+
+        return nwr
+
+
+    def set_all_lanes(self, table, force = False, verbose = False):
+        """
+        Programs the full channel space (NPUNCT x L) at once, skipping lanes whose words are unchanged.
+
+        :param table: dictionary or structured array with resonator_regs() arguments. Without a channel
+        field the values apply to all NCH channels.
+        :type table: dict
+        :return: number of lanes written.
+        :rtype: int
+        """
+        if isinstance(table, np.ndarray):
+            fields = {k : table[k] for k in table.dtype.names}
+        else:
+            fields = dict(table)
+        channel = fields.pop('channel', np.arange(self.NCH))
+
+        regs = self.resonator_regs(channel, verbose = verbose, **fields)
+        nwr = self.write_regs(regs, force = force)
+
+        if verbose:
+            print('{}: {} of {} lanes written'.format(self.__class__.__name__, nwr, len(regs)))
+
+        return nwr
+
     def setall(self, config, verbose = False):
         # Build configuration dictionary.
         self.set_resonator_config(config)
         
         # Set all resonators (L) to the same configuration.
-        for i in range(self.L):
-            # Overwrite lane.
-            config['lane'] = i
+        regs = np.tile(np.array(self.config2regs(config), dtype=np.int64) & 0xFFFFFFFF, (self.L, 1))
+        regs[:,10] = np.arange(self.L)
 
-            # Write values into hardware.
-            self.set_resonator_regs(config, verbose)
+        # Write values into hardware (unchanged lanes are skipped).
+        nwr = self.write_regs(regs)
+
+        if verbose:
+            print('{}: {} of {} lanes written'.format(self.__class__.__name__, nwr, self.L))
 
 class AxisFilterV1(SocIp):
     bindto = ['user.org:user:axis_filter_v1:1.0']
@@ -941,7 +1100,7 @@ class AxisFilterV1(SocIp):
 
     def allon(self):
         # all channels on.
-        self.dict['channels'] = np.arange(self.N)
+        self.dict['channels'] = list(range(self.N))
 
         # Puncture all channels.
         val = int(2**(self.N/self.L)-1)
@@ -984,3 +1143,78 @@ class AxisFilterV1(SocIp):
             # Write registers.
             self.write()
 
+    def masks(self, channels):
+        """
+        Computes the lane puncture words enabling the given channels.
+        Channel k is bit k//L of lane k%L.
+
+        :param channels: PFB channels.
+        :type channels: array
+        :return: one puncture word per lane.
+        :rtype: array
+        """
+        ch = np.asarray(channels, dtype=np.int64).ravel()
+        if np.any((ch < 0) | (ch >= self.N)):
+            raise ValueError("%s: channels must be within [0,%d]" % (self.fullpath, self.N-1))
+
+        lanes = np.zeros(self.L, dtype=np.uint64)
+        np.bitwise_or.at(lanes, ch % self.L, np.left_shift(np.uint64(1), (ch // self.L).astype(np.uint64)))
+        return lanes
+
+    def set_channels(self, channels, single = False, verbose = False):
+        """
+        Enables a set of channels writing the puncture registers once.
+
+        :param channels: PFB channels.
+        :type channels: array
+        :param single: if True, all other channels are disabled.
+        :type single: boolean
+        """
+        lanes = self.masks(channels)
+        if not single:
+            lanes |= np.array(self.dict['lanes'], dtype=np.uint64)
+
+        self.set_lanes(lanes, verbose = verbose)
+
+    def set_lanes(self, lanes, verbose = False):
+        """
+        Writes precomputed lane puncture words (see masks).
+        """
+        # Update structure.
+        self.dict['lanes'] = [int(v) for v in lanes]
+        self.dict['channels'] = self.lanes2ch(lanes).tolist()
+
+        if verbose:
+            for i, val in enumerate(self.dict['lanes']):
+                print('{}: punct{}_reg  = {}'.format(self.__class__.__name__, i, val))
+
+        # Write registers.
+        self.write()
+
+    def set_range(self, klow, khigh, single = False, verbose = False):
+        """
+        Enables channels [klow, khigh] writing the puncture registers once.
+        If klow > khigh the band wraps across channel 0: [klow, N-1] and [0, khigh].
+        """
+        ch = self.range2ch(klow, khigh)
+
+        if verbose:
+            print("{}: klow = {}, khigh = {}, {} channels".format(self.__class__.__name__, klow, khigh, len(ch)))
+
+        self.set_channels(ch, single = single, verbose = verbose)
+
+    def range2ch(self, klow, khigh):
+        # Channels [klow, khigh], wrapping across channel 0 if klow > khigh.
+        if klow <= khigh:
+            return np.arange(klow, khigh+1)
+        else:
+            return np.concatenate((np.arange(klow, self.N), np.arange(0, khigh+1)))
+
+    def lanes2ch(self, lanes):
+        # Enabled channels of the given lane puncture words.
+        lanes = np.asarray(lanes, dtype=np.uint64)
+        bits = np.arange(self.N//self.L, dtype=np.uint64)
+        on = (lanes[None,:] >> bits[:,None]) & np.uint64(1)
+        punct_id, lane = np.nonzero(on)
+        return punct_id*self.L + lane
+
@@ -249,6 +249,11 @@ class AbsPfbAnalysis(SocIp):
         else:
             return ch*self.dict['freq']['fc']
 
+    def freqs2ch(self,f):
+        # Vector version of freq2ch. Frequencies must be on -fs/2 .. fs/2.
+        k = np.round(np.asarray(f)/self.dict['freq']['fc']).astype(int)
+        return np.mod(k, self.dict['N'])
+
     def qout(self, qout):
         self.qout_reg = qout
 
@@ -469,6 +474,11 @@ class AbsPfbSynthesis(SocIp):
         else:
             return ch*self.dict['freq']['fc']
 
+    def freqs2ch(self,f):
+        # Vector version of freq2ch. Frequencies must be on -fs/2 .. fs/2.
+        k = np.round(np.asarray(f)/self.dict['freq']['fc']).astype(int)
+        return np.mod(k, self.dict['N'])
+
     def qout(self, value):
         self.qout_reg = value
 
@@ -1,4 +1,7 @@
 import os
+import time
+import json
+import hashlib
 from pynq.overlay import Overlay
 import xrfclk
 import xrfdc
@@ -8,18 +11,27 @@ from drivers.ip import *
 from drivers.pfb import *
 from drivers.dds import *
 from drivers.misc import *
-from drivers.ip import SocIp, QickMetadata, QickConfig
+from drivers.ip import SocIp, QickMetadata, HwhCache, StartupProfiler
+from drivers.config import QickConfig, plan_windows
 
 
 class RFDC(xrfdc.RFdc):
     """
     Extends the xrfdc driver.
-    Since operations on the RFdc tend to be slow (tens of ms), we cache the Nyquist zone and frequency.
+    Since operations on the RFdc tend to be slow (tens of ms), we cache the Nyquist zone and the complete mixer
+    settings of each block. The cache is filled on first read and updated on every write, so chains never need
+    to read back from the hardware.
     """
     bindto = ["xilinx.com:ip:usp_rf_data_converter:2.3",
               "xilinx.com:ip:usp_rf_data_converter:2.4",
               "xilinx.com:ip:usp_rf_data_converter:2.6"]
 
+    # Tile event source (see event_dict of the chains).
+    EVNT_SRC_TILE = 2
+
+    # Fine mixer NCO frequency bits.
+    B_NCO = 48
+
     def __init__(self, description):
         """
         Constructor method
@@ -28,109 +40,172 @@ class RFDC(xrfdc.RFdc):
         # Dictionary for configuration.
         self.dict = {}
 
-        # Initialize nqz and freq.
-        self.dict['nqz']  = {'adc' : {}, 'dac' : {}}
-        self.dict['freq'] = {'adc' : {}, 'dac' : {}}
+        # Initialize nqz, freq and mixer settings.
+        self.dict['nqz']   = {'adc' : {}, 'dac' : {}}
+        self.dict['freq']  = {'adc' : {}, 'dac' : {}}
+        self.dict['mixer'] = {'adc' : {}, 'dac' : {}}
+
+        # Counters of performed/elided operations.
+        self.reset_stats()
 
     def configure(self, soc):
         self.dict['cfg'] = {'adc' : soc.adcs, 'dac' : soc.dacs}
 
-    def set_mixer_freq(self, blockid, f, blocktype='dac'):
-        # Get config.
-        cfg = self.dict['cfg'][blocktype]
+    def reset_stats(self):
+        self.dict['stats'] = {  'mixer' : {'performed' : 0, 'elided' : 0},
+                                'nqz'   : {'performed' : 0, 'elided' : 0}}
+
+    @property
+    def stats(self):
+        """
+        Number of performed and elided RFDC mixer and Nyquist zone writes.
+        """
+        return {k : dict(v) for k, v in self.dict['stats'].items()}
 
-        # Check Nyquist zone.
-        fs = cfg[blockid]['fs']
-        if abs(f) > fs/2 and self.get_nyquist(blockid, blocktype)==2:
-            fset *= -1
+    def nco_word(self, blockid, f, blocktype='dac'):
+        # Quantized NCO frequency.
+        fs = self.dict['cfg'][blocktype][blockid]['fs']
+        return int(round(f/fs*2**self.B_NCO))
 
+    def get_block(self, blockid, blocktype='dac'):
         # Get tile and channel from id.
         tile, channel = [int(a) for a in blockid]
 
-        # Get Mixer Settings.
         if blocktype == 'adc':
-            m_set = self.adc_tiles[tile].blocks[channel].MixerSettings
+            return self.adc_tiles[tile].blocks[channel]
         elif blocktype == 'dac':
-            m_set = self.dac_tiles[tile].blocks[channel].MixerSettings
+            return self.dac_tiles[tile].blocks[channel]
         else:
-            raise RuntimeError("Blocktype %s not recognized" & blocktype)
+            raise RuntimeError("Blocktype %s not recognized" % blocktype)
+
+    def get_mixer_settings(self, blockid, blocktype='dac'):
+        """
+        Returns the cached mixer settings of the block. Do not modify the returned dictionary.
+        """
+        try:
+            return self.dict['mixer'][blocktype][blockid]
+        except KeyError:
+            # Fill mixer dictionary.
+            m_set = dict(self.get_block(blockid, blocktype).MixerSettings)
+            self.dict['mixer'][blocktype][blockid] = m_set
+            self.dict['freq'][blocktype][blockid] = m_set['Freq']
 
-        # Make a copy of mixer settings.
-        m_set_copy = m_set.copy()
+            return m_set
 
-        # Update the copy
-        m_set_copy.update({
-            'Freq': f,
-            'PhaseOffset': 0})
+    def set_mixer_freq(self, blockid, f, blocktype='dac'):
+        self.set_mixer_freqs({(blocktype, blockid) : f})
 
-        # Update settings.
-        if blocktype == 'adc':
-            self.adc_tiles[tile].blocks[channel].MixerSettings = m_set_copy
-            self.adc_tiles[tile].blocks[channel].UpdateEvent(xrfdc.EVENT_MIXER)
-            self.dict['freq'][blocktype][blockid] = f
-        elif blocktype == 'dac':
-            self.dac_tiles[tile].blocks[channel].MixerSettings = m_set_copy
-            self.dac_tiles[tile].blocks[channel].UpdateEvent(xrfdc.EVENT_MIXER)
+    def set_mixer_freqs(self, freqs, tile_event=True, force=False):
+        """
+        Sets several ADC/DAC NCO frequencies and fires the update events together.
+
+        :param freqs: dictionary {(blocktype, blockid) : f}, e.g. {('adc','20') : -500, ('dac','01') : 500}.
+        :type freqs: dict
+        :param tile_event: when all the updated blocks of a tile use the tile event source, fire a single
+        tile-level event for them instead of one event per block. Only blocks of the same tile (and blocktype)
+        share an event, so an ADC and a DAC are always updated with one event each.
+        :type tile_event: boolean
+        :param force: write even if the quantized NCO frequency is unchanged.
+        :type force: boolean
+        """
+        # Write all the settings first.
+        tiles = {}
+        for (blocktype, blockid), f in freqs.items():
+            # Get config.
+            cfg = self.dict['cfg'][blocktype]
+
+            # Check Nyquist zone.
+            fs = cfg[blockid]['fs']
+            if abs(f) > fs/2 and self.get_nyquist(blockid, blocktype)==2:
+                fset = -f
+            else:
+                fset = f
+
+            # Need to update?
+            m_set = self.get_mixer_settings(blockid, blocktype)
+            if not force and m_set['PhaseOffset'] == 0 and \
+                    self.nco_word(blockid, fset, blocktype) == self.nco_word(blockid, m_set['Freq'], blocktype):
+                self.dict['stats']['mixer']['elided'] += 1
+                continue
+            self.dict['stats']['mixer']['performed'] += 1
+
+            # Make a copy of the cached mixer settings.
+            m_set_copy = m_set.copy()
+
+            # Update the copy
+            m_set_copy.update({
+                'Freq': fset,
+                'PhaseOffset': 0})
+
+            # Update settings.
+            block = self.get_block(blockid, blocktype)
+            block.MixerSettings = m_set_copy
+
+            # Update cache.
+            self.dict['mixer'][blocktype][blockid] = m_set_copy
             self.dict['freq'][blocktype][blockid] = f
-        else:
-            raise RuntimeError("Blocktype %s not recognized" & blocktype)
-        
+
+            # Group blocks by tile for the update events.
+            tiles.setdefault((blocktype, blockid[0]), []).append((block, m_set_copy['EventSource']))
+
+        # Fire update events.
+        for blocks in tiles.values():
+            if tile_event and all([src == self.EVNT_SRC_TILE for _, src in blocks]):
+                # One tile-level event updates all the blocks of the tile.
+                blocks[0][0].UpdateEvent(xrfdc.EVENT_MIXER)
+            else:
+                for block, _ in blocks:
+                    block.UpdateEvent(xrfdc.EVENT_MIXER)
 
     def get_mixer_freq(self, blockid, blocktype='dac'):
         try:
             return self.dict['freq'][blocktype][blockid]
         except KeyError:
-            # Get tile and channel from id.
-            tile, channel = [int(a) for a in blockid]
-
-            # Fill freq dictionary.
-            if blocktype == 'adc':
-                self.dict['freq'][blocktype][blockid] = self.adc_tiles[tile].blocks[channel].MixerSettings['Freq']
-            elif blocktype == 'dac':
-                self.dict['freq'][blocktype][blockid] = self.dac_tiles[tile].blocks[channel].MixerSettings['Freq']
-            else:
-                raise RuntimeError("Blocktype %s not recognized" & blocktype)
-
-            return self.dict['freq'][blocktype][blockid]
+            return self.get_mixer_settings(blockid, blocktype)['Freq']
 
     def set_nyquist(self, blockid, nqz, blocktype='dac', force=False):
         # Check valid selection.
         if nqz not in [1,2]:
             raise RuntimeError("Nyquist zone must be 1 or 2")
 
-        # Get tile and channel from id.
-        tile, channel = [int(a) for a in blockid]
-
         # Need to update?
         if not force and self.get_nyquist(blockid,blocktype) == nqz:
+            self.dict['stats']['nqz']['elided'] += 1
             return
+        self.dict['stats']['nqz']['performed'] += 1
 
-        if blocktype == 'adc':
-            self.adc_tiles[tile].blocks[channel].NyquistZone = nqz
-            self.dict['nqz'][blocktype][blockid] = nqz
-        elif blocktype == 'dac':
-            self.dac_tiles[tile].blocks[channel].NyquistZone = nqz
-            self.dict['nqz'][blocktype][blockid] = nqz
-        else:
-            raise RuntimeError("Blocktype %s not recognized" & blocktype)
+        self.get_block(blockid, blocktype).NyquistZone = nqz
+        self.dict['nqz'][blocktype][blockid] = nqz
 
     def get_nyquist(self, blockid, blocktype='dac'):
         try:
             return self.dict['nqz'][blocktype][blockid]
         except KeyError:
-            # Get tile and channel from id.
-            tile, channel = [int(a) for a in blockid]
-
             # Fill nqz dictionary.
-            if blocktype == 'adc':
-                self.dict['nqz'][blocktype][blockid] = self.adc_tiles[tile].blocks[channel].NyquistZone
-            elif blocktype == 'dac':
-                self.dict['nqz'][blocktype][blockid] = self.dac_tiles[tile].blocks[channel].NyquistZone
-            else:
-                raise RuntimeError("Blocktype %s not recognized" & blocktype)
+            self.dict['nqz'][blocktype][blockid] = self.get_block(blockid, blocktype).NyquistZone
 
             return self.dict['nqz'][blocktype][blockid]
 
+def block_or_none(soc, chain, key):
+    # Resolve the IP block of a chain entry, or None if the chain does not have it.
+    name = chain.get(key)
+    if name is None:
+        return None
+    return getattr(soc, name)
+
+def set_mixer_pair(analysis, synthesis, f):
+    # Retune the ADC and DAC NCOs of an analysis/synthesis pair in one RFDC batch.
+    if analysis.dict['mixer']['type'] != 'fine' or synthesis.dict['mixer']['type'] != 'fine':
+        raise RuntimeError("Mixer not active")
+
+    # -fmix on the ADC to get upper sideband and avoid mirroring.
+    analysis.soc.rf.set_mixer_freqs({('adc', analysis.dict['chain']['adc']['id'])  : -f,
+                                     ('dac', synthesis.dict['chain']['dac']['id']) : f})
+
+    # Update local copy of frequency values.
+    analysis.update_settings()
+    synthesis.update_settings()
+
 class AnalysisChain():
     # Event dictionary.
     event_dict = {
@@ -167,6 +242,13 @@ class AnalysisChain():
             'fine' : 2,
             'off' : 3,
         }}
+
+    # Reverse lookup tables (register value -> key).
+    event_lut = {k : {v : key for key, v in d.items()} for k, d in event_dict.items()}
+    mixer_lut = {k : {v : key for key, v in d.items()} for k, d in mixer_dict.items()}
+
+    # Block handles are resolved once in the constructor (None if the chain does not have the block).
+    __slots__ = ('soc', 'dict', 'pfb_b', 'dds_b', 'cic_b', 'kidsim_b', 'chsel_b', 'streamer_b', 'ready')
     
     # Constructor.
     def __init__(self, soc, chain):
@@ -190,43 +272,57 @@ class AnalysisChain():
                 # Update settings.
                 self.update_settings()
                     
-                # pfb block.
-                pfb = getattr(self.soc, self.dict['chain']['pfb'])
-
-                # Does the chain has a chsel?
-                if pfb.HAS_CHSEL:
-                    self.maskall()
-
-                # Does the chain has a streamer?
-                if pfb.HAS_STREAMER:
-                    # Default streamer samples.
-                    streamer = getattr(self.soc, self.dict['chain']['streamer'])
-                    streamer.set(10000)
+                # Blocks.
+                self.pfb_b      = getattr(self.soc, chain['pfb'])
+                self.dds_b      = block_or_none(self.soc, chain, 'dds')
+                self.cic_b      = block_or_none(self.soc, chain, 'cic')
+                self.kidsim_b   = block_or_none(self.soc, chain, 'kidsim')
+                self.chsel_b    = block_or_none(self.soc, chain, 'chsel')
+                self.streamer_b = block_or_none(self.soc, chain, 'streamer')
+
+                # Hardware initialization is deferred to first use (see setup).
+                self.ready = False
+                self.dict['nsamp'] = None
 
                 # Does the chain has a dds?
-                if pfb.HAS_DDSCIC or pfb.HAS_DDS_DUAL:
+                if self.pfb_b.HAS_DDSCIC or self.pfb_b.HAS_DDS_DUAL:
                     # Frequency resolution (MHz).
-                    dds = getattr(self.soc, self.dict['chain']['dds'])
-                    self.dict['fr'] = dds.DF_DDS/1e6
+                    self.dict['fr'] = self.dds_b.DF_DDS/1e6
                 
                 # Does the chain has a kidsim?
-                elif pfb.HAS_KIDSIM:
+                elif self.pfb_b.HAS_KIDSIM:
                     # Frequency resolution (MHz).
-                    kidsim = getattr(self.soc, self.dict['chain']['kidsim'])
-                    self.dict['fr'] = kidsim.DF_DDS/1e6
+                    self.dict['fr'] = self.kidsim_b.DF_DDS/1e6
+
+    def setup(self):
+        """
+        Hardware initialization deferred from the constructor: masks all channels and sets the default
+        number of streamer samples. Called on first use; it does nothing afterwards.
+        """
+        if self.ready:
+            return
+        self.ready = True
+
+        # Does the chain has a chsel?
+        if self.chsel_b is not None:
+            self.chsel_b.alloff()
+
+        # Does the chain has a streamer?
+        if self.streamer_b is not None and self.dict['nsamp'] is None:
+            self.set_nsamp(10000)
  
     def update_settings(self):
-        tile = int(self.dict['chain']['adc']['tile'])
-        ch = int(self.dict['chain']['adc']['ch'])
-        m_set = self.soc.rf.adc_tiles[tile].blocks[ch].MixerSettings
+        # Read from the RFDC cache (no hardware read-back).
+        blockid = self.dict['chain']['adc']['id']
+        m_set = self.soc.rf.get_mixer_settings(blockid, 'adc')
         self.dict['mixer'] = {
-            'mode'     : self.return_key(self.mixer_dict['mode'], m_set['MixerMode']),
-            'type'     : self.return_key(self.mixer_dict['type'], m_set['MixerType']),
-            'evnt_src' : self.return_key(self.event_dict['source'], m_set['EventSource']),
+            'mode'     : self.mixer_lut['mode'].get(m_set['MixerMode'], 'Key Not Found'),
+            'type'     : self.mixer_lut['type'].get(m_set['MixerType'], 'Key Not Found'),
+            'evnt_src' : self.event_lut['source'].get(m_set['EventSource'], 'Key Not Found'),
             'freq'     : m_set['Freq'],
         }
         
-        self.dict['nqz'] = self.soc.rf.adc_tiles[tile].blocks[ch].NyquistZone        
+        self.dict['nqz'] = self.soc.rf.get_nyquist(blockid, 'adc')
         
     def set_mixer_frequency(self, f):
         if self.dict['mixer']['type'] != 'fine':
@@ -248,12 +344,9 @@ class AnalysisChain():
         return('Key Not Found')
     
     def source(self, source="product"):
-        # Get dds block.
-        dds_b = getattr(self.soc, self.dict['chain']['dds'])
-        
-        if dds_b is not None:
+        if self.dds_b is not None:
             # Set source.
-            dds_b.dds_outsel(source)
+            self.dds_b.dds_outsel(source)
     
     def set_decimation(self, value=2, autoq=True):
         """
@@ -264,14 +357,11 @@ class AnalysisChain():
         :param autoq: flag for automatic quantization setting.
         :type autoq: boolean
         """
-        # Get block.
-        cic_b   = getattr(self.soc, self.dict['chain']['cic'])
-
-        if cic_b is not None:
+        if self.cic_b is not None:
             if autoq:
-                cic_b.decimation(value)
+                self.cic_b.decimation(value)
             else:
-                cic_b.decimate(value)
+                self.cic_b.decimate(value)
     
     def unmask(self, ch=0, single=True, verbose=False):
         """
@@ -283,27 +373,34 @@ class AnalysisChain():
         :param single: flag for single transaction at a time.
         :type single: boolean
         """
-        # Get chsel.
-        chsel = getattr(self.soc, self.dict['chain']['chsel'])
-                
+        self.setup()
+
         # Unmask channel.
-        chsel.set(ch=ch, single=single, verbose=verbose)
+        self.chsel_b.set(ch=ch, single=single, verbose=verbose)
         
     def maskall(self):
         """
         Mask all channels of the Channel Selection block of the chain.
         """
-        # Get chsel.
-        chsel = getattr(self.soc, self.dict['chain']['chsel'])
-        
         # Mask all channels.
-        chsel.alloff()
+        self.chsel_b.alloff()
     
+    def set_nsamp(self, nsamp=10000):
+        """
+        Sets the number of samples per channel captured by the streamer. The streamer buffer is only
+        re-allocated when the value changes.
+
+        :param nsamp: number of samples.
+        :type nsamp: int
+        """
+        if nsamp != self.dict['nsamp']:
+            self.streamer_b.set(nsamp)
+            self.dict['nsamp'] = nsamp
+
     def anyenabled(self):
-        # Get chsel.
-        chsel = getattr(self.soc, self.dict['chain']['chsel'])
-        
-        if len(chsel.enabled_channels) > 0:
+        self.setup()
+
+        if len(self.chsel_b.enabled_channels) > 0:
             return True
         else:
             return False          
@@ -323,8 +420,8 @@ class AnalysisChain():
         :rtype:[array,array]
         """
         # Get blocks.
-        pfb_b = getattr(self.soc, self.dict['chain']['pfb'])
-        dds_b = getattr(self.soc, self.dict['chain']['dds'])
+        pfb_b = self.pfb_b
+        dds_b = self.dds_b
 
         # Sanity check: is frequency on allowed range?
         fmix = abs(self.dict['mixer']['freq'])
@@ -354,32 +451,25 @@ class AnalysisChain():
             raise ValueError("Frequency value %f out of allowed range [%f,%f]" % (f,fmix-fs/2,fmix+fs/2))
 
     def get_data(self, ch=0, verbose=False):
-        # Get blocks.
-        chsel_b    = getattr(self.soc, self.dict['chain']['chsel'])
-        streamer_b = getattr(self.soc, self.dict['chain']['streamer'])
-        
         # Unmask channel.
         self.unmask(ch, verbose=verbose)
         
-        return streamer_b.get_data(nt=1, idx = chsel_b.ch2idx(ch))
+        return self.streamer_b.get_data(nt=1, idx = self.chsel_b.ch2idx(ch))
     
     def get_data_all(self, verbose=False):
         """
         Get the data from all the enabled channels.
         """
-        # Get blocks.        
-        streamer_b = getattr(self.soc, self.dict['chain']['streamer'])
-        
         # Check if any channel is enabled.
         if self.anyenabled():
             if verbose:
                 print("{}: Some channels are enabled. Retrieving data...".format(__class__.__name__))
             
-            return streamer_b.get_data_all(verbose=verbose)
+            return self.streamer_b.get_data_all(verbose=verbose)
 
     def freq2ch(self, f):
         # Get blocks.
-        pfb_b = getattr(self.soc, self.dict['chain']['pfb'])
+        pfb_b = self.pfb_b
         
         # Sanity check: is frequency on allowed range?
         fmix = abs(self.dict['mixer']['freq'])
@@ -391,9 +481,31 @@ class AnalysisChain():
         else:
             raise ValueError("Frequency value %f out of allowed range [%f,%f]" % (f,fmix-fs/2,fmix+fs/2))
 
+    def freqs2ch(self, f):
+        """
+        Vector version of freq2ch.
+
+        :param f: frequencies in MHz.
+        :type f: array
+        :return: PFB channels.
+        :rtype: array
+        """
+        # Get blocks.
+        pfb_b = self.pfb_b
+
+        # Sanity check: are frequencies on allowed range?
+        fmix = abs(self.dict['mixer']['freq'])
+        fs = self.dict['chain']['fs']
+        f = np.asarray(f)
+
+        if np.all(((fmix-fs/2) < f) & (f < (fmix+fs/2))):
+            return pfb_b.freqs2ch(f - fmix)
+        else:
+            raise ValueError("Frequency values out of allowed range [%f,%f]" % (fmix-fs/2,fmix+fs/2))
+
     def ch2freq(self, ch):
         # Get blocks.
-        pfb_b = getattr(self.soc, self.dict['chain']['pfb'])
+        pfb_b = self.pfb_b
 
         # Mixer frequency.
         fmix = abs(self.dict['mixer']['freq'])
@@ -402,8 +514,7 @@ class AnalysisChain():
         return f+fmix
     
     def qout(self,q):
-        pfb = getattr(self.soc, self.dict['chain']['pfb'])
-        pfb.qout(q)
+        self.pfb_b.qout(q)
         
     @property
     def fs(self):
@@ -425,10 +536,8 @@ class AnalysisChain():
     
     @property
     def decimation(self):
-        cic_b   = getattr(self.soc, self.dict['chain']['cic'])
-
-        if cic_b is not None:
-            return cic_b.get_decimate()
+        if self.cic_b is not None:
+            return self.cic_b.get_decimate()
         else:
             return 1
     
@@ -438,7 +547,7 @@ class AnalysisChain():
     
     @property
     def dds(self):
-        return getattr(self.soc, self.dict['chain']['ddscic'])    
+        return self.dds_b
         
 class SynthesisChain():
     # Event dictionary.
@@ -475,7 +584,14 @@ class SynthesisChain():
             'coarse' : 1,
             'fine' : 2,
             'off' : 3,
-        }}    
+        }}
+
+    # Reverse lookup tables (register value -> key).
+    event_lut = {k : {v : key for key, v in d.items()} for k, d in event_dict.items()}
+    mixer_lut = {k : {v : key for key, v in d.items()} for k, d in mixer_dict.items()}    
+
+    # Block handles are resolved once in the constructor (None if the chain does not have the block).
+    __slots__ = ('soc', 'dict', 'pfb_b', 'dds_b', 'kidsim_b', 'ctrl_b', 'enabled_ch', 'ready')
 
     # Constructor.
     def __init__(self, soc, chain):
@@ -496,54 +612,62 @@ class SynthesisChain():
                 # Synthesis chain.
                 self.dict['chain'] = chain
 
+                # Blocks.
+                self.pfb_b      = block_or_none(self.soc, chain, 'pfb')
+                self.dds_b      = block_or_none(self.soc, chain, 'dds')
+                self.kidsim_b   = block_or_none(self.soc, chain, 'kidsim')
+                self.ctrl_b     = block_or_none(self.soc, chain, 'ctrl')
+
                 # Is this a PFB or Signal Generator-based chain?
                 if 'pfb' in chain.keys():
                     self.dict['type'] = 'pfb'
 
-                    # pfb block.
-                    pfb = getattr(self.soc, self.dict['chain']['pfb'])
-
                     # Does this chain has a dds?
-                    if pfb.HAS_DDS or pfb.HAS_DDS_DUAL:
+                    if self.pfb_b.HAS_DDS or self.pfb_b.HAS_DDS_DUAL:
                         # Set frequency resolution (MHz).
-                        ddscic = getattr(self.soc, self.dict['chain']['dds'])
-                        self.dict['fr'] = ddscic.DF_DDS/1e6
+                        self.dict['fr'] = self.dds_b.DF_DDS/1e6
 
                     # Does this chain has a kidsim?
-                    elif pfb.HAS_KIDSIM:
+                    elif self.pfb_b.HAS_KIDSIM:
                         # Set frequency resolution (MHz).
-                        kidsim = getattr(self.soc, self.dict['chain']['kidsim'])
-                        self.dict['fr'] = kidsim.DF_DDS/1e6
+                        self.dict['fr'] = self.kidsim_b.DF_DDS/1e6
                 elif 'gen' in chain.keys():
                     self.dict['type'] = 'gen'
 
                     # Set frequency resolution.
-                    ctrl = getattr(self.soc, self.dict['chain']['ctrl'])
-                    self.dict['fr'] = ctrl.dict['df']
+                    self.dict['fr'] = self.ctrl_b.dict['df']
                 else:
                     raise RuntimeError("Chain must have a PFB or Signal Generator")
 
                 # Update settings.
                 self.update_settings()
 
-                # Disable all output tones.
-                self.alloff()
+                # Output tones are disabled on first use (see setup).
+                self.ready = False
 
                 # Variable to keep track of active channel (pfb-based).
                 self.enabled_ch = None
+
+    def setup(self):
+        """
+        Hardware initialization deferred from the constructor: disables all output tones.
+        Called on first use; it does nothing afterwards.
+        """
+        if not self.ready:
+            self.alloff()
  
     def update_settings(self):
-        tile = int(self.dict['chain']['dac']['tile'])
-        ch = int(self.dict['chain']['dac']['ch'])
-        m_set = self.soc.rf.dac_tiles[tile].blocks[ch].MixerSettings
+        # Read from the RFDC cache (no hardware read-back).
+        blockid = self.dict['chain']['dac']['id']
+        m_set = self.soc.rf.get_mixer_settings(blockid, 'dac')
         self.dict['mixer'] = {
-            'mode'     : self.return_key(self.mixer_dict['mode'], m_set['MixerMode']),
-            'type'     : self.return_key(self.mixer_dict['type'], m_set['MixerType']),
-            'evnt_src' : self.return_key(self.event_dict['source'], m_set['EventSource']),
+            'mode'     : self.mixer_lut['mode'].get(m_set['MixerMode'], 'Key Not Found'),
+            'type'     : self.mixer_lut['type'].get(m_set['MixerType'], 'Key Not Found'),
+            'evnt_src' : self.event_lut['source'].get(m_set['EventSource'], 'Key Not Found'),
             'freq'     : m_set['Freq'],
         }
         
-        self.dict['nqz'] = self.soc.rf.dac_tiles[tile].blocks[ch].NyquistZone        
+        self.dict['nqz'] = self.soc.rf.get_nyquist(blockid, 'dac')
         
     def set_mixer_frequency(self, f):
         if self.dict['mixer']['type'] != 'fine':
@@ -566,17 +690,14 @@ class SynthesisChain():
     
     # Set all DDS channels off.
     def alloff(self):
-        if self.dict['type'] == 'pfb':
-            # pfb block.
-            pfb = getattr(self.soc, self.dict['chain']['pfb'])
+        self.ready = True
 
+        if self.dict['type'] == 'pfb':
             # Does this chain has a dds?
-            if pfb.HAS_DDS or pfb.HAS_DDS_DUAL:
-                dds = getattr(self.soc, self.dict['chain']['dds'])
-                dds.alloff()
+            if self.pfb_b.HAS_DDS or self.pfb_b.HAS_DDS_DUAL:
+                self.dds_b.alloff()
         else:
-            ctrl = getattr(self.soc, self.dict['chain']['ctrl'])
-            ctrl.set(g=0)
+            self.ctrl_b.set(g=0)
 
     # Set single output.
     def set_tone(self, f=0, g=0.99, cg=0, comp=False, verbose=False):
@@ -587,10 +708,11 @@ class SynthesisChain():
         if (fmix-fs/2) < f < (fmix+fs/2):
             f_ = f - fmix
 
+            self.setup()
 
             if self.dict['type'] == 'pfb':
-                pfb_b = getattr(self.soc, self.dict['chain']['pfb'])
-                dds_b = getattr(self.soc, self.dict['chain']['dds'])
+                pfb_b = self.pfb_b
+                dds_b = self.dds_b
                 k = pfb_b.freq2ch(f_)
             
                 # Compute resulting dds frequency.
@@ -637,8 +759,7 @@ class SynthesisChain():
                     self.enabled_ch = k
 
             elif self.dict['type'] == 'gen':
-                ctrl = getattr(self.soc, self.dict['chain']['ctrl'])
-                ctrl.set(f = f_, g = g)
+                self.ctrl_b.set(f = f_, g = g)
 
                 if verbose:
                     print("{}: f = {} MHz, fd = {} Mhz".format(__class__.__name__, f, f_))
@@ -658,10 +779,11 @@ class SynthesisChain():
         if (fmix-fs/2) < f < (fmix+fs/2):
             f_ = f - fmix
 
+            self.setup()
 
             if self.dict['type'] == 'pfb':
-                pfb_b = getattr(self.soc, self.dict['chain']['pfb'])
-                dds_b = getattr(self.soc, self.dict['chain']['dds'])
+                pfb_b = self.pfb_b
+                dds_b = self.dds_b
                 k = pfb_b.freq2ch(f_)
             
                 # Compute resulting dds frequency.
@@ -674,8 +796,7 @@ class SynthesisChain():
                     print("{}: f = {} MHz, fd = {} Mhz, k = {}, fdds = {} MHz".format(__class__.__name__, f, f_, k, fdds))
 
             elif self.dict['type'] == 'gen':
-                ctrl = getattr(self.soc, self.dict['chain']['ctrl'])
-                ctrl.set(f = f_, g = g)
+                self.ctrl_b.set(f = f_, g = g)
 
                 if verbose:
                     print("{}: f = {} MHz, fd = {} Mhz".format(__class__.__name__, f, f_))
@@ -688,7 +809,7 @@ class SynthesisChain():
 
     def freq2ch(self, f):
         # Get blocks.
-        pfb_b = getattr(self.soc, self.dict['chain']['pfb'])
+        pfb_b = self.pfb_b
         
         # Sanity check: is frequency on allowed range?
         fmix = abs(self.dict['mixer']['freq'])
@@ -701,9 +822,31 @@ class SynthesisChain():
         else:
             raise ValueError("Frequency value %f out of allowed range [%f,%f]" %(f, fmix-fs/2, fmix+fs/2))          
 
+    def freqs2ch(self, f):
+        """
+        Vector version of freq2ch.
+
+        :param f: frequencies in MHz.
+        :type f: array
+        :return: PFB channels.
+        :rtype: array
+        """
+        # Get blocks.
+        pfb_b = self.pfb_b
+
+        # Sanity check: are frequencies on allowed range?
+        fmix = abs(self.dict['mixer']['freq'])
+        fs = self.dict['chain']['fs']
+        f = np.asarray(f)
+
+        if np.all(((fmix-fs/2) < f) & (f < (fmix+fs/2))):
+            return pfb_b.freqs2ch(f - fmix)
+        else:
+            raise ValueError("Frequency values out of allowed range [%f,%f]" % (fmix-fs/2,fmix+fs/2))
+
     def ch2freq(self, ch):
         # Get blocks.
-        pfb_b = getattr(self.soc, self.dict['chain']['pfb'])
+        pfb_b = self.pfb_b
 
         # Sanity check: is frequency on allowed range?
         fmix = abs(self.dict['mixer']['freq'])
@@ -714,8 +857,7 @@ class SynthesisChain():
     # PFB quantization.
     def qout(self,q):
         if self.dict['type'] == 'pfb':
-            pfb = getattr(self.soc, self.dict['chain']['pfb'])
-            pfb.qout(q)
+            self.pfb_b.qout(q)
         
     @property
     def fs(self):
@@ -739,9 +881,152 @@ class SynthesisChain():
     
     @property
     def dds(self):
-        return getattr(self.soc, self.dict['chain']['dds'])
+        return self.dds_b
     
+class SweepCache():
+    """
+    On-disk cache for KidsChain sweeps.
+    Each sweep is stored in a npz file named after the hash of its settings: chain hardware (PFB blocks), fstart,
+    fend, N, g, decimation, mixer frequency and firmware timestamp. Partial sweeps store the number of completed points,
+    and sweeps stopped early by a DelayEstimator are marked as stopped.
+    """
+    def __init__(self, path="./sweep_cache"):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, chain, fstart, fend, N, g, decimation, fmix, timestamp, window=None):
+        settings = (str(chain), float(fstart), float(fend), int(N), float(g), int(decimation), float(fmix), str(timestamp))
+
+        # Acquisition window, if not the default one.
+        if window is not None and window != {'settle' : 100, 'navg' : 9800, 'stat' : 'mean'}:
+            settings += (int(window['settle']), int(window['navg']), str(window['stat']))
+        return hashlib.sha1(repr(settings).encode()).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key + ".npz")
+
+    def load(self, key):
+        fn = self.filename(key)
+        if not os.path.exists(fn):
+            return None
+
+        with np.load(fn) as data:
+            entry = {k : data[k] for k in data.files}
+        entry['stopped'] = bool(entry.get('stopped', False))
+        return entry
+
+    def save(self, key, f, a, phi, n, stopped=False):
+        # Write to a temporary file first so an interrupted save does not corrupt the entry.
+        fn = self.filename(key)
+        tmp = fn + ".tmp"
+        with open(tmp, 'wb') as fd:
+            np.savez(fd, f=f, a=a, phi=phi, n=n, stopped=stopped)
+        os.replace(tmp, fn)
+
+    def invalidate(self, key=None):
+        """
+        Remove one entry, or all entries if key is not given.
+        """
+        if key is not None:
+            keys = [key]
+        else:
+            keys = [fn[:-4] for fn in os.listdir(self.path) if fn.endswith(".npz")]
+
+        for k in keys:
+            fn = self.filename(k)
+            if os.path.exists(fn):
+                os.remove(fn)
+
+class DelayEstimator():
+    """
+    Streaming cable-delay estimator.
+    Phase is unwrapped as points arrive and a running linear fit of phase vs frequency gives the slope
+    (rad/MHz), the delay DT = slope/(2*pi) (us, same convention as KidsChain.phase_correction) and its
+    uncertainty. The frequency step must sample the phase at least twice per 1/DT.
+
+    :param tol: delay tolerance in us. None disables early stopping.
+    :type tol: float
+    :param nmin: minimum number of points before convergence is checked.
+    :type nmin: int
+    :param phase_cal: PFB channel boundary phase jump (rad) to be removed, as in phase_correction.
+    :type phase_cal: float
+    """
+    def __init__(self, tol=None, nmin=10, phase_cal=0):
+        self.tol = tol
+        self.nmin = nmin
+        self.phase_cal = phase_cal
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.k0 = None
+        self.phi_last = 0
+        self.phi_u = 0
+
+        # Running means and centered sums (Welford).
+        self.xm = 0
+        self.ym = 0
+        self.sxx = 0
+        self.sxy = 0
+        self.syy = 0
+
+    def update(self, f, phi, k=None):
+        # Unwrap phase.
+        if self.n == 0:
+            self.phi_u = phi
+        else:
+            self.phi_u += np.angle(np.exp(1j*(phi - self.phi_last)))
+        self.phi_last = phi
+
+        # Phase-jump correction.
+        y = self.phi_u
+        if k is not None:
+            if self.k0 is None:
+                self.k0 = k
+            y = y - self.phase_cal*(k - self.k0)
+
+        # Update running sums.
+        self.n += 1
+        dx = f - self.xm
+        dy = y - self.ym
+        self.xm += dx/self.n
+        self.ym += dy/self.n
+        self.sxx += dx*(f - self.xm)
+        self.sxy += dx*(y - self.ym)
+        self.syy += dy*(y - self.ym)
+
+    @property
+    def slope(self):
+        if self.n < 2 or self.sxx == 0:
+            return np.nan
+        return self.sxy/self.sxx
+
+    @property
+    def slope_err(self):
+        if self.n < 3 or self.sxx == 0:
+            return np.inf
+        ssr = max(self.syy - self.slope*self.sxy, 0)
+        return np.sqrt(ssr/(self.n-2)/self.sxx)
+
+    @property
+    def delay(self):
+        return self.slope/(2*np.pi)
+
+    @property
+    def delay_err(self):
+        return self.slope_err/(2*np.pi)
+
+    def converged(self):
+        if self.tol is None or self.n < self.nmin:
+            return False
+        return self.delay_err < self.tol
+
+    def __str__(self):
+        return "DT = {} us +/- {} us ({} points)".format(self.delay, self.delay_err, self.n)
+
 class KidsChain():
+    __slots__ = ('soc', 'name', 'force_dds', 'window', 'IS_DUAL', 'analysis', 'synthesis', 'fr')
+
     # Constructor.
     def __init__(self, soc, analysis=None, synthesis=None, dual=None, name=""):
         # Sanity check. Is soc the right type?
@@ -757,6 +1042,9 @@ class KidsChain():
             # Force dds flag.
             self.force_dds = False
 
+            # Averaging window of each sweep point (samples).
+            self.window = {'settle' : 100, 'navg' : 9800, 'stat' : 'mean'}
+
             # Check Chains.
             if analysis is None and synthesis is None:
                 # Must be a dual chain.
@@ -811,8 +1099,7 @@ class KidsChain():
         return int(np.round(f/self.fr))*self.fr
 
     def set_mixer_frequency(self, f):
-        self.analysis.set_mixer_frequency(-f) # -fmix to get upper sideband and avoid mirroring.
-        self.synthesis.set_mixer_frequency(f)
+        set_mixer_pair(self.analysis, self.synthesis, f)
 
     def set_tone(self, f=0, g=0.5, cg=0, comp=False, verbose=False):
         # Set tone using synthesis chain.
@@ -829,8 +1116,50 @@ class KidsChain():
     def get_bin(self, f=0, verbose=False):
         # Get data from bin using analysis chain.
         return self.analysis.get_bin(f=f, force_dds = self.force_dds, verbose=verbose)
+
+    def set_window(self, settle=100, navg=9800, stat="mean"):
+        """
+        Sets the acquisition window of each sweep point. The streamer is sized to exactly settle + navg samples.
+
+        :param settle: number of samples discarded after the tone is set.
+        :type settle: int
+        :param navg: number of samples averaged.
+        :type navg: int
+        :param stat: averaging statistic: mean, median or trimmed (10% trimmed mean).
+        :type stat: str
+        """
+        if stat not in ["mean", "median", "trimmed"]:
+            raise ValueError("%s: stat must be mean, median or trimmed" % (self.__class__.__name__))
+        if settle < 0 or navg < 1:
+            raise ValueError("%s: settle must be >= 0 and navg >= 1" % (self.__class__.__name__))
+
+        self.window = {'settle' : int(settle), 'navg' : int(navg), 'stat' : stat}
+        self.analysis.set_nsamp(self.window['settle'] + self.window['navg'])
+
+    def average(self, x):
+        # Average samples with the statistic of the acquisition window.
+        stat = self.window['stat']
+        if stat == "mean":
+            return x.mean()
+        elif stat == "median":
+            return np.median(x)
+        else:
+            n = len(x)//10
+            return np.sort(x)[n:len(x)-n].mean()
     
-    def sweep(self, fstart, fend, N=10, g=0.5, decimation = 2, set_mixer=True, verbose=False, showProgress=True):
+    def sweep(self, fstart, fend, N=10, g=0.5, decimation = 2, settle=100, navg=9800, stat="mean", set_mixer=True, cache=None, checkpoint=10, estimator=None, verbose=False, showProgress=True):
+        """
+        Frequency sweep. When a SweepCache is given, partial results are checkpointed to disk every checkpoint
+        seconds (so disk I/O does not grow with the square of N), an interrupted sweep resumes from the last
+        checkpointed point and a completed sweep with identical settings on the same PFBs is served from the cache.
+
+        Each point discards settle samples and averages the next navg samples with stat (see set_window).
+
+        When a DelayEstimator is given, it is reset, updated as points arrive (cached points included) and the
+        sweep stops early once the delay converges to the estimator tolerance. Only the measured points are
+        returned. A sweep stopped early is cached as stopped: it is served as is to sweeps with an estimator,
+        and resumed (with a notice) by sweeps without one.
+        """
         if set_mixer:
             # Set fmixer at the center of the sweep.
             fmix = (fstart + fend)/2
@@ -840,6 +1169,7 @@ class KidsChain():
         # Default settings.
         self.analysis.set_decimation(decimation)
         self.analysis.source("product")
+        self.set_window(settle=settle, navg=navg, stat=stat)
         
         f_v = np.linspace(fstart,fend,N)
 
@@ -854,46 +1184,361 @@ class KidsChain():
         fq_v = np.zeros(N)
         a_v = np.zeros(N)
         phi_v = np.zeros(N)
-        i_v = np.zeros(N)
-        q_v = np.zeros(N)
-        
+
+        # Resume from cache.
+        i0 = 0
+        stopped = False
+        if cache is not None:
+            chain = self.analysis.dict['chain']['pfb'] + "/" + self.synthesis.dict['chain']['pfb']
+            key = cache.key(chain, fstart, fend, N, g, decimation, self.synthesis.get_mixer_frequency(), self.soc.metadata.timestamp, window=self.window)
+            entry = cache.load(key)
+            if entry is not None:
+                i0 = int(entry['n'])
+                stopped = entry['stopped']
+                fq_v[:i0] = entry['f'][:i0]
+                a_v[:i0] = entry['a'][:i0]
+                phi_v[:i0] = entry['phi'][:i0]
+
+        # Feed resumed points to the delay estimator.
+        if estimator is not None:
+            estimator.reset()
+            for j in range(i0):
+                estimator.update(fq_v[j], phi_v[j], k=self.synthesis.freq2ch(fq_v[j]))
+
+        if i0 == N or (stopped and estimator is not None):
+            if showProgress:
+                print("Sweep served from cache ({})".format(key))
+            return fq_v[:i0],a_v[:i0],phi_v[:i0]
+
         if showProgress:
             print("Starting sweep:")
             print("  * Start      : {} MHz".format(fstart))
             print("  * End        : {} MHz".format(fend))
             print("  * Resolution : {} MHz".format(f_v[1]-f_v[0]))
             print("  * Points     : {}".format(N))
+            if i0 > 0:
+                print("  * Resume at  : {}{}".format(i0, " (sweep was stopped early by a delay estimator)" if stopped else ""))
             print(" ")
+
+        i = i0
+        nstop = N
+        stopped = False
+        t_ckpt = time.time()
+        try:
+            for i in range(i0, N):
+                f = f_v[i]
+
+                # Tone/capture cycle.
+                fq, a, phi = self.measure(f, g=g, verbose=verbose)
+
+                fq_v[i] = fq
+                a_v[i] = a
+                phi_v[i] = phi
+
+                if verbose:
+                    print("i = {}, f = {} MHz, fq = {} MHz, a = {}, phi = {}".format(i,f,fq,a,phi))
+                else:
+                    if showProgress: print("{}".format(i), end=", ")
+
+                # Checkpoint.
+                if cache is not None and time.time() - t_ckpt >= checkpoint:
+                    cache.save(key, fq_v, a_v, phi_v, i+1)
+                    t_ckpt = time.time()
+
+                # Online delay estimation.
+                if estimator is not None:
+                    estimator.update(fq, phi, k=self.synthesis.freq2ch(fq))
+                    if estimator.converged():
+                        nstop = i+1
+                        stopped = True
+                        if showProgress:
+                            print(" ")
+                            print("Delay converged after {} points: {}".format(nstop, estimator))
+                        break
+            i = nstop
+        finally:
+            # Keep completed points (also on exception or interrupt).
+            if cache is not None:
+                cache.save(key, fq_v, a_v, phi_v, i, stopped=stopped)
+
+        return fq_v[:nstop],a_v[:nstop],phi_v[:nstop]
+
+    def plan_windows(self, fstart, fend, overlap=1, frac=0.8):
+        """
+        Split [fstart,fend] into mixer windows of frac times the usable PFB bandwidth, overlapping by overlap MHz.
+        Windows are ordered starting from the end closest to the current mixer frequency, so the first window
+        can reuse the current mixer setting and every other window needs a single retune.
+        The same plan can be made offline with QickConfig.plan_windows.
+
+        :return: list of (flow, fhigh, fmix) tuples.
+        :rtype: list
+        """
+        bw = frac*min(self.analysis.fs, self.synthesis.fs)
+        return plan_windows(fstart, fend, bw, self.synthesis.get_mixer_frequency(), self.fq, overlap=overlap)
+
+    def sweep_wide(self, fstart, fend, N=1000, g=0.5, decimation=2, settle=100, navg=9800, stat="mean", overlap=10, min_overlap=3, frac=0.8, verbose=False, showProgress=True):
+        """
+        Wideband sweep. The span is split into mixer windows (see plan_windows), each window is swept on a common
+        frequency grid and chunks are stitched with the complex gain that aligns amplitude and phase on the
+        overlapping points.
+
+        :param N: total number of points over [fstart,fend].
+        :type N: int
+        :param overlap: number of grid points shared by neighbouring windows.
+        :type overlap: int
+        :param min_overlap: minimum number of common points to align two chunks (RuntimeError if fewer).
+        :type min_overlap: int
+        :return: frequency, amplitude, phase and a report with the windows, number of retunes and time spent on
+        the RFDC versus acquisition.
+        :rtype: (array,array,array,dict)
+        """
+        # Default settings.
+        self.analysis.set_decimation(decimation)
+        self.analysis.source("product")
+        self.set_window(settle=settle, navg=navg, stat=stat)
+
+        # Common frequency grid. Windows overlap by overlap grid steps.
+        f_grid = np.unique(np.round(np.linspace(fstart, fend, N)/self.fr)*self.fr)
+        step = np.max(np.diff(f_grid)) if len(f_grid) > 1 else self.fr
+        windows = self.plan_windows(fstart, fend, overlap=overlap*step, frac=frac)
+
+        report = {'windows' : windows, 'retunes' : 0, 't_rfdc' : 0, 't_acq' : 0}
+        chunks = {}
+        for flow, fhigh, fmix in windows:
+            # Retune only if needed.
+            t0 = time.perf_counter()
+            if fmix != self.synthesis.get_mixer_frequency():
+                self.set_mixer_frequency(fmix)
+                report['retunes'] += 1
+            t1 = time.perf_counter()
+
+            # Acquire window.
+            f_v = f_grid[(f_grid >= flow) & (f_grid <= fhigh)]
+            f, a, phi = self.measure_points(f_v, g=g, verbose=verbose)
+            t2 = time.perf_counter()
+
+            report['t_rfdc'] += t1 - t0
+            report['t_acq'] += t2 - t1
+            chunks[flow] = (f, a*np.exp(1j*phi))
+
+            if showProgress:
+                print("{}: window [{}, {}] MHz, fmix = {} MHz, {} points".format(__class__.__name__, flow, fhigh, fmix, len(f)))
+
+        # Stitch in frequency order, aligning each chunk to the previous one.
+        f_out, z_out = None, None
+        for flow in sorted(chunks.keys()):
+            f, z = chunks[flow]
+            if f_out is None:
+                f_out, z_out = f, z
+                continue
+
+            # Overlapping points.
+            common, i_ref, i_new = np.intersect1d(f_out, f, return_indices=True)
+            if len(common) < min_overlap:
+                raise RuntimeError("%s: %d overlapping points at %f MHz, at least %d needed to align chunks. Increase overlap."
+                                   % (__class__.__name__, len(common), flow, min_overlap))
+            r = z_out[i_ref]/z[i_new]
+            r = np.median(np.abs(r))*np.exp(1j*np.angle(np.mean(r/np.abs(r))))
+            z = z*r
+
+            keep = f > f_out[-1]
+            f_out = np.r_[f_out, f[keep]]
+            z_out = np.r_[z_out, z[keep]]
+
+        if showProgress:
+            print("{}: {} retunes, RFDC {:.3f} s, acquisition {:.3f} s".format(__class__.__name__, report['retunes'], report['t_rfdc'], report['t_acq']))
+
+        return f_out, np.abs(z_out), np.angle(z_out), report
+
+    def measure(self, f, g=0.5, verbose=False):
+        """
+        Single tone/capture cycle: output a tone at the quantized frequency and average its analysis bin.
+
+        :param f: frequency in MHz.
+        :type f: float
+        :param g: tone gain.
+        :type g: float
+        :return: quantized frequency, amplitude and phase.
+        :rtype: (float,float,float)
+        """
+        # Quantize frequency.
+        fq = self.fq(f)
+
+        # Set output tone.
+        self.set_tone(f=fq, g=g, verbose=verbose)
+
+        # Get input data.
+        [xi,xq] = self.get_bin(fq, verbose=verbose)
+
+        # Discard settling samples and average the window.
+        i0 = self.window['settle']
+        i1 = i0 + self.window['navg']
+        iMean = self.average(xi[i0:i1])
+        qMean = self.average(xq[i0:i1])
+
+        # Amplitude and phase.
+        a = np.abs(iMean + 1j*qMean)
+        phi = np.angle(iMean + 1j*qMean)
+
+        return fq, a, phi
+
+    def measure_points(self, f_v, g=0.5, verbose=False):
+        """
+        Measure an arbitrary list of frequencies. Mixer, decimation and source are not modified.
+        """
+        N = len(f_v)
+        fq_v = np.zeros(N)
+        a_v = np.zeros(N)
+        phi_v = np.zeros(N)
         for i,f in enumerate(f_v):
-            # Quantize frequency.
-            fq = self.fq(f)
-            
-            # Set output tone.
-            self.set_tone(f=fq, g=g, verbose=verbose)
-            
-            # Get input data.
-            [xi,xq] = self.get_bin(fq, verbose=verbose)
-          
-            i0 = 100
-            i1 = -100
-            iMean = xi[i0:i1].mean()
-            qMean = xq[i0:i1].mean()
-            
-            # Amplitude and phase.
-            a = np.abs(iMean + 1j*qMean)
-            phi = np.angle(iMean + 1j*qMean)
+            fq_v[i], a_v[i], phi_v[i] = self.measure(f, g=g, verbose=verbose)
 
-            fq_v[i] = fq
-            a_v[i] = a
-            phi_v[i] = phi
-            
-            if verbose:
-                print("i = {}, f = {} MHz, fq = {} MHz, a = {}, phi = {}".format(i,f,fq,a,phi))
-            else:
-                if showProgress: print("{}".format(i), end=", ")
-         
         return fq_v,a_v,phi_v
 
+    def find_candidates(self, f, a, phi, threshold=0.5, nsigma=5, phase=True):
+        """
+        Find resonator candidates on a sweep: amplitude dips and phase-slope anomalies.
+
+        :param threshold: dips must be below threshold times the median amplitude.
+        :type threshold: float
+        :param nsigma: phase-slope anomaly level, in units of the robust slope spread.
+        :type nsigma: float
+        :param phase: flag to also look for phase-slope anomalies. The sweep step must sample the cable delay.
+        :type phase: boolean
+        :return: indexes of the candidates, one per contiguous run of anomalous points.
+        :rtype: array
+        """
+        # Amplitude dips: local minima below threshold.
+        a_p = np.r_[np.inf, a, np.inf]
+        is_min = (a_p[1:-1] <= a_p[:-2]) & (a_p[1:-1] <= a_p[2:])
+        idx = np.argwhere(is_min & (a < threshold*np.median(a))).reshape(-1)
+
+        # Phase-slope anomalies: deviation from the (delay dominated) median slope.
+        if phase and len(f) > 2:
+            dphi = np.diff(np.unwrap(phi))/np.diff(f)
+            med = np.median(dphi)
+            mad = 1.4826*np.median(np.abs(dphi - med))
+            if mad > 0:
+                jdx = np.argwhere(np.abs(dphi - med) > nsigma*mad).reshape(-1)
+
+                # Keep the lowest amplitude point of each anomalous pair.
+                jdx = np.where(a[jdx+1] < a[jdx], jdx+1, jdx)
+                idx = np.union1d(idx, jdx)
+
+        # Merge contiguous runs of candidates (a broad resonance), keeping the lowest amplitude point of each run.
+        if len(idx) > 1:
+            runs = np.split(idx, np.flatnonzero(np.diff(idx) > 1) + 1)
+            idx = np.array([r[np.argmin(a[r])] for r in runs])
+
+        return idx
+
+    def refine(self, fc, df, N=10, g=0.5, verbose=False):
+        """
+        Recursively zoom around a candidate until the DDS resolution is reached.
+
+        :param fc: candidate frequency in MHz.
+        :type fc: float
+        :param df: half-width of the window in MHz.
+        :type df: float
+        :param N: number of points per refinement level.
+        :type N: int
+        :return: frequency, amplitude, phase and number of tone/capture cycles used.
+        :rtype: (float,float,float,int)
+        """
+        step = 2*df/(N-1)
+
+        # Last level: use the DDS resolution.
+        if step <= self.fr:
+            f_v = np.arange(self.fq(fc-df), self.fq(fc+df)+self.fr/2, self.fr)
+        else:
+            f_v = np.linspace(fc-df, fc+df, N)
+
+        f, a, phi = self.measure_points(f_v, g=g, verbose=verbose)
+        i = np.argmin(a)
+
+        if verbose:
+            print("{}: fc = {} MHz, df = {} MHz, step = {} MHz, fmin = {} MHz".format(__class__.__name__, fc, df, step, f[i]))
+
+        if step <= self.fr:
+            return f[i], a[i], phi[i], len(f_v)
+
+        fr_, a_, phi_, n = self.refine(f[i], step, N=N, g=g, verbose=verbose)
+
+        return fr_, a_, phi_, n+len(f_v)
+
+    def search(self, fstart, fend, N=100, Nref=10, g=0.5, decimation=2, settle=100, navg=9800, stat="mean", threshold=0.5, nsigma=5, phase=True, merge=3, set_mixer=True, verbose=False, showProgress=True):
+        """
+        Adaptive resonator search: coarse sweep, candidate detection and refinement down to the DDS resolution.
+
+        :param fstart: start frequency in MHz.
+        :type fstart: float
+        :param fend: end frequency in MHz.
+        :type fend: float
+        :param N: number of points of the coarse sweep.
+        :type N: int
+        :param Nref: number of points per refinement level.
+        :type Nref: int
+        :param merge: refined resonators closer than merge DDS bins (self.fr) are merged, keeping the deepest.
+        :type merge: int
+        :return: dictionary with resonator frequencies, amplitudes, phases and the measurement budget.
+        :rtype: dict
+        """
+        if set_mixer:
+            # Set fmixer at the center of the search.
+            fmix = (fstart + fend)/2
+            fmix = self.fq(fmix)
+            self.set_mixer_frequency(fmix)
+
+        # Default settings.
+        self.analysis.set_decimation(decimation)
+        self.analysis.source("product")
+        self.set_window(settle=settle, navg=navg, stat=stat)
+
+        # Coarse pass.
+        f, a, phi = self.measure_points(np.linspace(fstart, fend, N), g=g, verbose=verbose)
+        idx = self.find_candidates(f, a, phi, threshold=threshold, nsigma=nsigma, phase=phase)
+        df = (fend - fstart)/(N-1)
+
+        if showProgress:
+            print("{}: coarse step = {} MHz, {} candidates".format(__class__.__name__, df, len(idx)))
+
+        # Refine candidates.
+        data = {'freq' : [], 'amp' : [], 'phi' : []}
+        nref = 0
+        for i in idx:
+            fr_, a_, phi_, n = self.refine(f[i], df, N=Nref, g=g, verbose=verbose)
+            nref += n
+
+            # Merge candidates converging to the same resonator.
+            if len(data['freq']) > 0:
+                k = np.argmin(np.abs(np.array(data['freq']) - fr_))
+                if np.abs(data['freq'][k] - fr_) <= merge*self.fr:
+                    if a_ < data['amp'][k]:
+                        data['freq'][k], data['amp'][k], data['phi'][k] = fr_, a_, phi_
+                    continue
+
+            data['freq'].append(fr_)
+            data['amp'].append(a_)
+            data['phi'].append(phi_)
+
+            if showProgress:
+                print("{}: resonator at {} MHz".format(__class__.__name__, fr_))
+
+        # Sort by frequency.
+        order = np.argsort(data['freq'])
+        for key in ['freq', 'amp', 'phi']:
+            data[key] = np.array(data[key])[order]
+
+        # Measurement budget.
+        dense = int(np.ceil((fend - fstart)/self.fr))
+        total = N + nref
+        data['budget'] = {'coarse' : N, 'refine' : nref, 'total' : total, 'dense' : dense, 'ratio' : dense/total}
+
+        if showProgress:
+            print("{}: {} tone/capture cycles ({} for a dense sweep, {:.1f}x less)".format(__class__.__name__, total, dense, dense/total))
+
+        return data
+
     def phase_slope(self, f, phi):
         # Compute phase jumps.
         dphi = np.diff(phi)
@@ -918,9 +1563,7 @@ class KidsChain():
         phi_dt = phi_dt - phi_dt[0]
 
         # Phase-jump correction.
-        k = np.zeros(len(f))
-        for i in range(len(f)):
-            k[i] = self.synthesis.freq2ch(f[i])
+        k = self.synthesis.freqs2ch(f)
 
         # Apply jump compensation.
         phi_dt = phi_dt - phase_cal*(k - k[0])
@@ -928,72 +1571,89 @@ class KidsChain():
         return phi_u, phi_dt
 
     def phase_fit(self, f, phi, jumps=True, gap=5):
+        """
+        Linear phase fits. With jumps=True, one fit per section between phase jumps (PFB channel boundaries),
+        excluding gap points at each side of the jumps. All sections are solved at once with segment labels.
+
+        :return: dictionary with:
+            * jump : {'threshold', 'index', 'value'} of the jumps (as before).
+            * fits : structured array with start, end, npoints, slope, offset and valid of each section. Sections
+              with less than 2 points (jumps closer than 2*gap to an edge or to each other) have valid=False and
+              NaN slope/offset.
+            * data : structured array with x, y, fn (fitted value), segment label and valid flag of each point.
+        :rtype: dict
+        """
+        f = np.asarray(f, dtype=np.float64)
+        phi = np.asarray(phi, dtype=np.float64)
+        n = len(f)
+        j = np.arange(n)
+
         # Dictionary for output data.
         data = {}
-        data['fits'] = []
-        
+
         # Delay estimation using phase jumps.
         if jumps:
             # Phase diff.
             phi_diff = np.diff(phi)
-            
+
             # Find jumps.
-            jv = 0.8*np.max(np.abs(phi_diff))                
+            jv = 0.8*np.max(np.abs(phi_diff))
             idx = np.argwhere(np.abs(phi_diff) > jv).reshape(-1)
-            data['jump'] = {'threshold' : jv, 'index' : idx, 'value' : phi_diff[idx]}
-            
-            idx_start = 0
-            idx_end = len(f)
-            for i in range(len(idx)):
-                idx_end = idx[i]
-                
-                # Move away from midpoint.
-                idx_start = idx_start + gap
-                idx_end = idx_end - gap
-                
-                x = f[idx_start:idx_end]
-                y = phi[idx_start:idx_end]
-                coef = np.polyfit(x,y,1)
-                fit_fn = np.poly1d(coef)
-                
-                fit_ = {'slope' : coef[0], 'data' : {'x' : x, 'y': y, 'fn' : fit_fn(x)}}
-                data['fits'].append(fit_)
-                
-                # Update start index.
-                idx_start = idx_end + gap
-                
-            # Section after last jump.
-            idx_end = len(f)
-    
-            # Move away from midpoint.
-            idx_start = idx_start + gap
-            idx_end = idx_end - gap
-    
-            x = f[idx_start:idx_end]
-            y = phi[idx_start:idx_end]
-            coef = np.polyfit(x,y,1)
-            fit_fn = np.poly1d(coef)
-    
-            fit_ = {'slope' : coef[0], 'data' : {'x' : x, 'y': y, 'fn' : fit_fn(x)}}
-            data['fits'].append(fit_)        
-            
-            return data
-        
-        # Overall delay estimation.
+
+            # Segment labels and boundaries (away from jumps by gap points).
+            seg = np.searchsorted(idx, j, side='left')
+            lo = np.r_[0, idx][seg] + gap
+            hi = np.r_[idx, n][seg] - gap
+            valid = (j >= lo) & (j < hi)
         else:
-            coef   = np.polyfit(f,phi, 1)
-            fit_fn = np.poly1d(coef)
-            
-            fit_ = {'slope' : coef[0], 'data' : {'x' : f, 'y' : phi, 'fn' : fit_fn(f)}}
-            data['fits'].append(fit_)
-            
-            return data
+            jv = np.nan
+            idx = np.zeros(0, dtype=int)
+            seg = np.zeros(n, dtype=int)
+            valid = np.ones(n, dtype=bool)
+
+        data['jump'] = {'threshold' : jv, 'index' : idx, 'value' : phi_diff[idx] if jumps else np.zeros(0)}
+
+        # Closed-form least squares over all segments (centered to avoid cancellation).
+        nseg = len(idx) + 1
+        w = valid.astype(np.float64)
+        cnt = np.bincount(seg, weights=w, minlength=nseg)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xm = np.bincount(seg, weights=w*f, minlength=nseg)/cnt
+            ym = np.bincount(seg, weights=w*phi, minlength=nseg)/cnt
+            dx = np.where(valid, f - xm[seg], 0)
+            dy = np.where(valid, phi - ym[seg], 0)
+            slope = np.bincount(seg, weights=dx*dy, minlength=nseg)/np.bincount(seg, weights=dx*dx, minlength=nseg)
+        offset = ym - slope*xm
+
+        # A line needs at least 2 points: mark the other sections.
+        fit_ok = cnt > 1
+        slope[~fit_ok] = np.nan
+        offset[~fit_ok] = np.nan
+
+        data['fits'] = np.zeros(nseg, dtype=[('start', int), ('end', int), ('npoints', int), ('slope', np.float64), ('offset', np.float64), ('valid', bool)])
+        data['fits']['start'] = np.r_[0, idx] + gap if jumps else 0
+        data['fits']['end'] = np.r_[idx, n] - gap if jumps else n
+        data['fits']['npoints'] = cnt
+        data['fits']['slope'] = slope
+        data['fits']['offset'] = offset
+        data['fits']['valid'] = fit_ok
+
+        data['data'] = np.zeros(n, dtype=[('x', np.float64), ('y', np.float64), ('fn', np.float64), ('segment', int), ('valid', bool)])
+        data['data']['x'] = f
+        data['data']['y'] = phi
+        data['data']['fn'] = slope[seg]*f + offset[seg]
+        data['data']['segment'] = seg
+        data['data']['valid'] = valid
+
+        return data
 
     def qout(self,q):
         self.analysis.qout(q)
         self.synthesis.qout(q)
 
 class SimuChain():
+    __slots__ = ('soc', 'name', 'analysis', 'synthesis', 'fr', 'pfb_b', 'kidsim_b', 'states', 'states_fmix')
+
     # Constructor.
     def __init__(self, soc, simu=None, name=""):
         # Sanity check. Is soc the right type?
@@ -1010,14 +1670,21 @@ class SimuChain():
             self.analysis   = AnalysisChain(self.soc, simu['analysis'])
             self.synthesis  = SynthesisChain(self.soc, simu['synthesis'])
 
+            # Blocks.
+            self.pfb_b      = self.analysis.pfb_b
+            self.kidsim_b   = self.analysis.kidsim_b
+
+            # Precompiled resonator states (register words) and the mixer frequency they were compiled for.
+            self.states = []
+            self.states_fmix = None
+
             # Frequency resolution.
             fr_min = min(self.analysis.fr,self.synthesis.fr)
             fr_max = max(self.synthesis.fr,self.synthesis.fr)
             self.fr = fr_max
 
     def set_mixer_frequency(self, f):
-        self.analysis.set_mixer_frequency(-f) # -fmix to get upper sideband and avoid mirroring.
-        self.synthesis.set_mixer_frequency(f)
+        set_mixer_pair(self.analysis, self.synthesis, f)
 
     def enable(self, f, verbose=False):
         # Config dictionary.
@@ -1033,14 +1700,12 @@ class SimuChain():
         # Config dictionary.
         cfg_ = {'sel' : 'input'}
 
-        # Kidsim block.
-        kidsim_b = getattr(self.soc, self.analysis.dict['chain']['kidsim'])
-        kidsim_b.setall(cfg_, verbose=verbose) 
+        self.kidsim_b.setall(cfg_, verbose=verbose) 
 
     def set_resonator(self, cfg, verbose=False):
         # Get blocks.
-        pfb_b       = getattr(self.soc, self.analysis.dict['chain']['pfb'])
-        kidsim_b    = getattr(self.soc, self.analysis.dict['chain']['kidsim'])
+        pfb_b       = self.pfb_b
+        kidsim_b    = self.kidsim_b
 
         # Sanity check: is frequency on allowed range?
         fmix = abs(self.analysis.get_mixer_frequency())
@@ -1067,7 +1732,85 @@ class SimuChain():
         else:
             raise ValueError("Frequency value %f out of allowed range [%f,%f]" % (f,fmix-fs/2,fmix+fs/2))
 
+    def set_resonators(self, table, verbose=False):
+        """
+        Programs many resonators at once. Register words are computed vectorized and written in one pass.
+
+        :param table: structured array (or dictionary of arrays) with field freq (MHz) and, optionally,
+        sweep_freq (MHz), sweep_time (us), iir_c0, iir_c1, sel and dds_wait. Missing fields take the
+        set_resonator defaults.
+        :type table: array
+        :return: register words written (see AxisKidsimV3.resonator_regs).
+        :rtype: array
+        """
+        regs = self.resonator_regs(table, verbose=verbose)
+        self.kidsim_b.write_regs(regs)
+
+        return regs
+
+    def resonator_regs(self, table, verbose=False):
+        # Fields of the table.
+        if isinstance(table, np.ndarray):
+            fields = {k : table[k] for k in table.dtype.names}
+        else:
+            fields = dict(table)
+        f = np.atleast_1d(np.asarray(fields.pop('freq'), dtype=np.float64))
+
+        # Sanity check: are frequencies on allowed range?
+        fmix = abs(self.analysis.get_mixer_frequency())
+        fs = self.analysis.fs
+        if not np.all(((fmix-fs/2) < f) & (f < (fmix+fs/2))):
+            raise ValueError("Frequency values out of allowed range [%f,%f]" % (fmix-fs/2,fmix+fs/2))
+
+        # PFB channels and DDS frequencies.
+        f_ = f - fmix
+        N = self.pfb_b.dict['N']
+        k = self.pfb_b.freqs2ch(f_)
+        fdds = f_ - np.where(k >= N/2, k - N, k)*self.pfb_b.dict['freq']['fc']
+
+        return self.kidsim_b.resonator_regs(k, dds_freq=fdds, verbose=verbose, **fields)
+
+    def compile_states(self, states):
+        """
+        Precompiles a list of resonator states into register words, so they can be replayed with replay().
+        States are compiled for the current mixer frequency.
+
+        :param states: list of resonator tables (see set_resonators), e.g. {'freq' : 1000, 'sel' : 'resonator'}.
+        :type states: list
+        :return: number of compiled states.
+        :rtype: int
+        """
+        self.states = [self.resonator_regs(table) for table in states]
+        self.states_fmix = self.analysis.get_mixer_frequency()
+        return len(self.states)
+
+    def replay(self, k, force=True):
+        """
+        Writes precompiled state k. With force=True (default) every resonator word of the state is written, so the
+        latency does not depend on the previous state. With force=False lanes already holding the words are skipped.
+        States must be recompiled after a mixer retune.
+        """
+        if len(self.states) == 0:
+            raise RuntimeError("%s: no states compiled, call compile_states first" % (self.__class__.__name__))
+        if self.states_fmix != self.analysis.get_mixer_frequency():
+            raise RuntimeError("%s: states were compiled for mixer frequency %s MHz, recompile them" % (self.__class__.__name__, self.states_fmix))
+
+        return self.kidsim_b.write_regs(self.states[k], force=force)
+
+    def predict(self, table, x=None, nsamp=1000):
+        """
+        Predicts the I/Q output of the resonators of table (see set_resonators) with the software model
+        of the KIDSIM block, without writing to the hardware.
+
+        :return: time (us) and complex output of each resonator.
+        :rtype: (array, array)
+        """
+        regs = self.resonator_regs(table)
+        return self.kidsim_b.model().run(regs, x=x, nsamp=nsamp)
+
 class FilterChain():
+    __slots__ = ('soc', 'name', 'analysis', 'synthesis', 'pfb_b', 'filt_b', 'ready', 'profiles')
+
     # Constructor.
     def __init__(self, soc, chain=None, name=""):
         # Sanity check. Is soc the right type?
@@ -1084,20 +1827,34 @@ class FilterChain():
             self.analysis   = AnalysisChain(self.soc, chain['analysis'])
             self.synthesis  = SynthesisChain(self.soc, chain['synthesis'])
 
-            # Activate all channels.
+            # Blocks.
+            self.pfb_b      = self.analysis.pfb_b
+            self.filt_b     = getattr(self.soc, chain['analysis']['filter'])
+
+            # All channels are activated on first use (see setup).
+            self.ready = False
+
+            # Compiled filter profiles.
+            self.profiles = {}
+
+    def setup(self):
+        """
+        Hardware initialization deferred from the constructor: activates all channels.
+        Called on first use; it does nothing afterwards.
+        """
+        if not self.ready:
             self.allon()
 
     def set_mixer_frequency(self, f):
-        self.analysis.set_mixer_frequency(-f) # -fmix to get upper sideband and avoid mirroring.
-        self.synthesis.set_mixer_frequency(f)
+        set_mixer_pair(self.analysis, self.synthesis, f)
 
     def allon(self):
-        filt_b = getattr(self.soc, self.analysis.dict['chain']['filter'])
-        filt_b.allon()
+        self.ready = True
+        self.filt_b.allon()
 
     def alloff(self):
-        filt_b = getattr(self.soc, self.analysis.dict['chain']['filter'])
-        filt_b.alloff()
+        self.ready = True
+        self.filt_b.alloff()
 
     def band(self, flow, fhigh, single = True, verbose = False):
         # Config.
@@ -1119,10 +1876,12 @@ class FilterChain():
     def set_channel(self, cfg, single = False, verbose=False):
         if single:
             self.alloff()
+        else:
+            self.setup()
 
         # Get blocks.
-        pfb_b   = getattr(self.soc, self.analysis.dict['chain']['pfb'])
-        filt_b  = getattr(self.soc, self.analysis.dict['chain']['filter'])
+        pfb_b   = self.pfb_b
+        filt_b  = self.filt_b
 
         # Sanity check: is frequency on allowed range?
         fmix = abs(self.analysis.get_mixer_frequency())
@@ -1154,12 +1913,12 @@ class FilterChain():
             raise ValueError("Frequency value %f out of allowed range [%f,%f]" % (f,fmix-fs/2,fmix+fs/2))
 
     def set_channel_range(self, cfg, single = False, verbose=False):
-        if single:
-            self.alloff()
+        if not single:
+            self.setup()
 
         # Get blocks.
-        pfb_b   = getattr(self.soc, self.analysis.dict['chain']['pfb'])
-        filt_b  = getattr(self.soc, self.analysis.dict['chain']['filter'])
+        pfb_b   = self.pfb_b
+        filt_b  = self.filt_b
 
         # Sanity check: is frequency on allowed range?
         fmix = abs(self.analysis.get_mixer_frequency())
@@ -1190,36 +1949,9 @@ class FilterChain():
                 if verbose:
                     print("{}: flow = {} MHz, klow = {}, fhigh = {} MHz, khigh = {}, ".format(__class__.__name__, flow, klow, fhigh, khigh))
 
-                # Check if crossing 0 channel.
-                if klow>khigh:
-                    # Enable channels [klow,N]
-                    for k in np.arange(klow,filt_b.N):
-
-                        # Update config structure.
-                        cfg['channel'] = k
-
-                        # Set channel in filter block.
-                        filt_b.set_channel(cfg, verbose)
-
-                    # Enable channels [0..khigh]
-                    for k in np.arange(0,khigh+1):
-
-                        # Update config structure.
-                        cfg['channel'] = k
-
-                        # Set channel in filter block.
-                        filt_b.set_channel(cfg, verbose)
-                    
-
-                else:
-                    # Enable channels.
-                    for k in np.arange(klow,khigh+1):
-
-                        # Update config structure.
-                        cfg['channel'] = k
-
-                        # Set channel in filter block.
-                        filt_b.set_channel(cfg, verbose)
+                # Enable channels [klow,khigh] (wrapping across channel 0) with a single register write.
+                filt_b.set_range(klow, khigh, single = single, verbose = verbose)
+                self.ready = True
             else:
                 raise ValueError("Frequency value %f out of allowed range [%f,%f]" % (fhigh,fmix-fs/2,fmix+fs/2))
         else:
@@ -1228,21 +1960,82 @@ class FilterChain():
     def bypass(self):
         # Enable all channels.
         self.allon()
+
+    def compile_profile(self, name, bands=None, channels=None):
+        """
+        Compiles a named filter profile into the lane puncture words of the filter block.
+        Profiles depend on the mixer frequency, which is stored with them.
+
+        :param name: profile name.
+        :type name: str
+        :param bands: list of (flow, fhigh) bands in MHz.
+        :type bands: list
+        :param channels: PFB channels.
+        :type channels: array
+        :return: lane puncture words.
+        :rtype: list
+        """
+        ch = []
+        if bands is not None:
+            for flow, fhigh in bands:
+                if flow > fhigh:
+                    raise ValueError("%s: freq_low = %f MHz cannot be higher than freq_high = %f MHz" % (self.__class__.__name__,flow,fhigh))
+                klow, khigh = self.analysis.freqs2ch([flow, fhigh])
+                ch.append(self.filt_b.range2ch(klow, khigh))
+        if channels is not None:
+            ch.append(np.asarray(channels))
+
+        lanes = self.filt_b.masks(np.concatenate(ch) if ch else [])
+        self.profiles[name] = {'lanes' : [int(v) for v in lanes], 'fmix' : self.analysis.get_mixer_frequency()}
+
+        return self.profiles[name]['lanes']
+
+    def use_profile(self, name, verbose=False):
+        """
+        Switches to a compiled filter profile with a single register write.
+        """
+        profile = self.profiles[name]
+        if profile['fmix'] != self.analysis.get_mixer_frequency():
+            raise RuntimeError("%s: profile %s was compiled for mixer frequency %f MHz" % (self.__class__.__name__, name, profile['fmix']))
+
+        self.ready = True
+        self.filt_b.set_lanes(profile['lanes'], verbose = verbose)
+
+    def save_profiles(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.profiles, f, indent=1)
+
+    def load_profiles(self, path):
+        with open(path) as f:
+            self.profiles.update(json.load(f))
         
 
 class TopSoc(Overlay, QickConfig):    
 
+    # Chain configuration entries stored in the HWH topology cache.
+    TOPO_KEYS = ['analysis', 'synthesis', 'dual', 'simu', 'filter']
+
     # Constructor.
-    def __init__(self, bitfile, force_init_clks=False, ignore_version=True, **kwargs):
+    def __init__(self, bitfile, force_init_clks=False, ignore_version=True, hwh_cache=None, profile=False, **kwargs):
         """
         Constructor method
+
+        :param hwh_cache: directory of the persistent HWH topology cache (see HwhCache), or None to disable it.
+        :type hwh_cache: str
+        :param profile: record the startup time per phase and per IP driver constructor (see self.profiler).
+        :type profile: bool
         """
 
         self.external_clk = False
         self.clk_output = False
 
+        # Startup profiler.
+        self.profiler = StartupProfiler(enabled=profile)
+        self.profiler.start()
+
         # Load bitstream.
-        Overlay.__init__(self, bitfile, ignore_version=ignore_version, download=False, **kwargs)
+        with self.profiler.section('Overlay.__init__'):
+            Overlay.__init__(self, bitfile, ignore_version=ignore_version, download=False, **kwargs)
 
         # Initialize the configuration
         self._cfg = {}
@@ -1250,31 +2043,48 @@ class TopSoc(Overlay, QickConfig):
         self['board'] = os.environ["BOARD"]
         
         # Read the config to get a list of enabled ADCs and DACs, and the sampling frequencies.
-        self.list_rf_blocks(
-            self.ip_dict['usp_rf_data_converter_0']['parameters'])
+        with self.profiler.section('list_rf_blocks'):
+            self.list_rf_blocks(
+                self.ip_dict['usp_rf_data_converter_0']['parameters'])
 
-        self.config_clocks(force_init_clks)
+        with self.profiler.section('config_clocks'):
+            self.config_clocks(force_init_clks)
 
         # RF data converter (for configuring ADCs and DACs, and setting NCOs)
-        self.rf = self.usp_rf_data_converter_0
-        self.rf.configure(self)
+        with self.profiler.section('rfdc'):
+            self.rf = self.usp_rf_data_converter_0
+            self.rf.configure(self)
 
         # Extract the IP connectivity information from the HWH parser and metadata.
-        self.metadata = QickMetadata(self)
+        with self.profiler.section('QickMetadata'):
+            cache = None if hwh_cache is None else HwhCache(hwh_cache)
+            self.metadata = QickMetadata(self, cache)
+
+        with self.profiler.section('map_signal_paths'):
+            self.map_signal_paths(self.metadata.cached)
 
-        self.map_signal_paths()
+        # Store the topology for the next start.
+        if cache is not None and self.metadata.cached is None:
+            cache.save(self.metadata.key, {
+                'timestamp'     : self.metadata.timestamp,
+                'metadata'      : self.metadata.tables(),
+                'connections'   : self.connections,
+                'cfg'           : {k : self[k] for k in self.TOPO_KEYS}})
 
         # Configure mr_buffer blocks.
-        switch_ = getattr(self, self.mr_buffer_et_0.dict['switch'])
-        dma_    = getattr(self, self.mr_buffer_et_0.dict['dma'])
-        self.mr_buffer_et_0.configure(dma=dma_, switch=switch_)
-        self.mr_buffer_et_1.configure(dma=dma_, switch=switch_)
+        with self.profiler.section('mr_buffer'):
+            switch_ = getattr(self, self.mr_buffer_et_0.dict['switch'])
+            dma_    = getattr(self, self.mr_buffer_et_0.dict['dma'])
+            self.mr_buffer_et_0.configure(dma=dma_, switch=switch_)
+            self.mr_buffer_et_1.configure(dma=dma_, switch=switch_)
 
         # Add blocks to structure.
         self.captures = []
         self.captures.append(self.mr_buffer_et_0)
         self.captures.append(self.mr_buffer_et_1)
 
+        self.profiler.stop()
+
     def description(self):
         """Generate a printable description of the QICK configuration.
 
@@ -1348,11 +2158,76 @@ class TopSoc(Overlay, QickConfig):
 
         return "\nQICK configuration:\n"+"\n".join(lines)
 
-    def map_signal_paths(self):
+    def export_config(self, path=None):
+        """
+        Exports the board-independent configuration: the chain configuration plus the PFB (fs, fc, fb, N),
+        DDS resolution, chsel (L, NCH) and mixer state of each chain. The result can be loaded with QickConfig
+        to plan frequencies offline without pynq (see drivers/config.py: QickConfig.freq2ch, ch2freq, fq, freq2dds,
+        plan_windows and plan_tones).
+
+        :param path: if given, JSON file where the configuration is written.
+        :type path: str
+        :return: configuration dictionary.
+        :rtype: dict
+        """
+        def export_chain(ch):
+            ch = dict(ch)
+
+            # PFB.
+            pfb = getattr(self, ch['pfb'])
+            ch['pfb_cfg'] = {'fs' : pfb.dict['freq']['fs'],
+                             'fc' : pfb.dict['freq']['fc'],
+                             'fb' : pfb.dict['freq']['fb'],
+                             'N'  : pfb.dict['N']}
+
+            # DDS frequency resolution (MHz).
+            for key in ['dds', 'kidsim']:
+                if ch.get(key) is not None:
+                    ch['fr'] = getattr(self, ch[key]).DF_DDS/1e6
+                    break
+
+            # Channel selection.
+            if ch.get('chsel') is not None:
+                chsel = getattr(self, ch['chsel'])
+                ch['chsel_cfg'] = {'L' : chsel.L, 'NCH' : chsel.NCH}
+
+            # Mixer.
+            blocktype = 'adc' if ch['type'] == 'analysis' else 'dac'
+            blockid = ch[blocktype]['id']
+            m_set = self.rf.get_mixer_settings(blockid, blocktype)
+            ch['mixer'] = {'freq'   : m_set['Freq'],
+                           'type'   : AnalysisChain.mixer_lut['type'].get(m_set['MixerType'], 'Key Not Found'),
+                           'nqz'    : self.rf.get_nyquist(blockid, blocktype)}
+
+            return ch
+
+        cfg = dict(self._cfg)
+        cfg['rf'] = {'adcs' : self.adcs, 'dacs' : self.dacs}
+        cfg['analysis']  = [export_chain(ch) for ch in self['analysis']]
+        cfg['synthesis'] = [export_chain(ch) for ch in self['synthesis']]
+
+        # Paired chains refer to the exported analysis/synthesis chains.
+        bypfb = {ch['pfb'] : ch for ch in cfg['analysis'] + cfg['synthesis']}
+        for key in ['dual', 'simu', 'filter']:
+            cfg[key] = [{k : bypfb[v['pfb']] if isinstance(v, dict) and 'pfb' in v else v for k, v in ch.items()}
+                        for ch in self[key]]
+
+        if path is not None:
+            QickConfig(cfg).save(path)
+
+        return cfg
+
+    def map_signal_paths(self, topo=None):
         # Use the HWH parser to trace connectivity and deduce the channel numbering.
+        # With a cached topology the traced connections are restored instead.
+        self.connections = {}
         for key, val in self.ip_dict.items():
             if hasattr(val['driver'], 'configure_connections'):
-                getattr(self, key).configure_connections(self)
+                if topo is None:
+                    self.connections[key] = getattr(self, key).trace_connections(self)
+                else:
+                    self.connections[key] = topo['connections'][key]
+                    getattr(self, key).restore_connections(self, self.connections[key])
 
         # PFB for Analysis.
         self.pfbs_in = []
@@ -1414,6 +2289,20 @@ class TopSoc(Overlay, QickConfig):
 
         self['adcs'] = list(self.adcs.keys())
         self['dacs'] = list(self.dacs.keys())
+
+        # Chain configuration from cache.
+        if topo is not None:
+            for k in self.TOPO_KEYS:
+                self[k] = topo['cfg'][k]
+
+            # JSON does not keep object identity: link paired chains back to the analysis/synthesis entries.
+            bypfb = {ch['pfb'] : ch for ch in self['analysis'] + self['synthesis']}
+            for k in ['dual', 'simu', 'filter']:
+                for ch in self[k]:
+                    ch['analysis']  = bypfb[ch['analysis']['pfb']]
+                    ch['synthesis'] = bypfb[ch['synthesis']['pfb']]
+            return
+
         self['analysis'] = []
         self['synthesis'] = []
         self['dual'] = []
@@ -1538,12 +2427,16 @@ class TopSoc(Overlay, QickConfig):
     def config_clocks(self, force_init_clks):
         """
         Configure PLLs if requested, or if any ADC/DAC is not locked.
+        If the PL already holds this exact bitstream (see bitstream_loaded) and all PLLs are locked, e.g. when
+        reconnecting to a board configured by a previous session, nothing is downloaded.
         """
               
         # if we're changing the clock config, we must set the clocks to apply the config
         if force_init_clks:
             self.set_all_clks()
             self.download()
+        elif self.bitstream_loaded() and self.clocks_locked():
+            return
         else:
             self.download()
             if not self.clocks_locked():
@@ -1553,6 +2446,32 @@ class TopSoc(Overlay, QickConfig):
             print(
                 "Not all DAC and ADC PLLs are locked. You may want to repeat the initialization of the QickSoc.")
 
+    def bitstream_loaded(self):
+        """
+        Checks whether the PL holds this bitstream, comparing the bitfile name and content hash with the ones
+        pynq recorded in its global state when the PL was last programmed. This does not rely on the Overlay
+        timestamp, which can be empty with download=False.
+        Without a recorded hash (pynq older than 3.0, or no bitstream downloaded since boot) it returns False,
+        so the bitstream is downloaded.
+
+        :return: True if the loaded bitstream is this one.
+        :rtype: bool
+        """
+        try:
+            from pynq.pl_server.global_state import global_state_file_exists, load_global_state, bitstream_hash
+        except ImportError:
+            return False
+
+        if not global_state_file_exists():
+            return False
+
+        state = load_global_state()
+        if os.path.basename(state.bitfile_name) != os.path.basename(self.bitfile_name):
+            return False
+
+        loaded_hash = getattr(state, 'bitfile_hash', None)
+        return loaded_hash is not None and loaded_hash == bitstream_hash(self.bitfile_name)
+
     def set_all_clks(self):
         """
         Resets all the board clocks
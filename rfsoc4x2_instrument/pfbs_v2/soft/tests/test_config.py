@@ -0,0 +1,35 @@
+"""
+Offline planning with an exported configuration (no pynq needed).
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from drivers.config import QickConfig, plan_windows
+
+def chain(fmix, fs=1000, N=64, fr=0.001):
+    return {'pfb_cfg' : {'fs' : fs, 'fc' : fs/N, 'fb' : fs/N, 'N' : N}, 'fr' : fr,
+            'mixer' : {'freq' : fmix, 'type' : 'fine', 'nqz' : 1}}
+
+def pair(fmix=500):
+    return {'analysis' : chain(-fmix), 'synthesis' : chain(fmix)}
+
+def test_plan_windows_cover_span_with_overlap():
+    w = plan_windows(100, 2000, 800, 0, lambda f: f, overlap=2)
+    w = sorted(w)
+    assert w[0][0] == 100 and w[-1][1] == 2000
+    for (l0, h0, _), (l1, h1, _) in zip(w[:-1], w[1:]):
+        assert h0 - l1 == pytest.approx(2)
+
+def test_plan_windows_start_near_mixer():
+    w = plan_windows(100, 2000, 800, 1900, lambda f: f, overlap=2)
+    assert w[0][1] == 2000
+
+def test_plan_tones_match_channels():
+    cfg = QickConfig({'dual' : [pair()]})
+    f = np.array([400.0003, 610.2])
+    program, fmix = cfg.plan_tones(cfg['dual'][0], f, fmix=510)
+    assert fmix == 510
+    assert np.allclose(program['f'], [400.0, 610.2])
+    # Channel center plus DDS frequency gives back the tone.
+    assert np.allclose(cfg.ch2freq(dict(cfg['dual'][0]['synthesis'], mixer={'freq' : 510}), program['ch']) + program['dds_freq'], program['f'])
@@ -0,0 +1,52 @@
+"""
+AxisFilterV1 lane puncture masks.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from conftest import description
+from drivers.misc import AxisFilterV1
+
+def filt(L=8, N=256):
+    return AxisFilterV1(description('axis_filter_v1', B=16, L=L, N=N))
+
+def test_masks_match_set_channel():
+    ch = [0, 3, 8, 17, 100, 255]
+    a = filt()
+    a.alloff()
+    for k in ch:
+        a.set_channel({'channel' : k})
+
+    b = filt()
+    b.set_channels(ch, single=True)
+
+    assert b.dict['lanes'] == a.dict['lanes']
+    assert list(b.mmio.array[:b.L]) == a.dict['lanes']
+    assert sorted(b.dict['channels']) == ch
+
+def test_lanes2ch_roundtrip():
+    b = filt()
+    ch = np.random.default_rng(1).choice(b.N, 40, replace=False)
+    assert sorted(b.lanes2ch(b.masks(ch))) == sorted(ch)
+
+def test_set_channels_keeps_enabled():
+    b = filt()
+    b.alloff()
+    b.set_channels([1, 2])
+    b.set_channels([5])
+    assert sorted(b.dict['channels']) == [1, 2, 5]
+
+def test_set_range_wraps():
+    b = filt()
+    b.set_range(250, 3, single=True)
+    assert sorted(b.dict['channels']) == [0, 1, 2, 3, 250, 251, 252, 253, 254, 255]
+
+def test_allon_sets_all_lanes():
+    b = filt()
+    assert len(b.dict['channels']) == b.N
+    assert sorted(b.lanes2ch(b.dict['lanes'])) == list(range(b.N))
+
+def test_masks_range_check():
+    with pytest.raises(ValueError):
+        filt().masks([256])
@@ -0,0 +1,43 @@
+"""
+KidsimModel: numpy model of the KIDSIM resonator data path.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from drivers.kidsim import KidsimModel
+
+C0 = 0.99
+C1 = 0.8
+G  = (1+C1)/(1+C0)
+
+def steady_gain(w, nsamp=20000):
+    # Gain of the IIR for a tone of w rad/sample, after the transient.
+    n = np.arange(nsamp)
+    x = np.exp(1j*w*n)
+    y = KidsimModel(fs=1).iir(x, C0, C1, G)[0]
+    return abs(y[-1]/x[-1])
+
+def test_iir_off_resonance_unity_gain():
+    assert steady_gain(np.pi) == pytest.approx(1.0, abs=1e-9)
+
+def test_iir_resonance_dip():
+    assert steady_gain(0) == pytest.approx(G*(1-C0)/(1-C1), rel=1e-6)
+    assert steady_gain(0) < 0.05
+
+def test_iir_matches_recursion():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal(500) + 1j*rng.standard_normal(500)
+    y = np.zeros(len(x), dtype=complex)
+    for n in range(len(x)):
+        y[n] = G*(x[n] - (C0*x[n-1] if n else 0)) + (C1*y[n-1] if n else 0)
+    assert np.allclose(KidsimModel(fs=1).iir(x, C0, C1, G)[0], y)
+
+def test_dds_ramp_starts_at_bval():
+    m = KidsimModel(fs=1)
+    # bval, slope, steps, wait, freq, c0, c1, g, outsel, punct_id, addr.
+    regs = np.array([[100, 10, 10, 1, 5000, 0, 0, 0, 1, 0, 0]])
+    w = m.dds_words(regs, 30)[0]
+    assert w[0] == 5100
+    assert w[2] == 5090
+    assert w[-1] == 5000
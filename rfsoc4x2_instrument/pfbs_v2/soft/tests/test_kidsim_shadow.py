@@ -0,0 +1,62 @@
+"""
+Register shadow of AxisKidsimV3: writes are only skipped when the lane already holds the same words.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from conftest import description
+from drivers.misc import AxisKidsimV3
+
+class Registers(np.ndarray):
+    # Register array counting write enable pulses.
+    def __setitem__(self, i, v):
+        if i == AxisKidsimV3.REGISTERS['we_reg'] and v == 1:
+            self.pulses += 1
+        super().__setitem__(i, v)
+
+def kidsim(L=8):
+    b = AxisKidsimV3(description('axis_kidsim_v3', L=L))
+    b.mmio.array = np.zeros(len(AxisKidsimV3.REGISTERS), dtype=np.uint32).view(Registers)
+    b.mmio.array.pulses = 0
+    b.configure(fs=1.0)
+    return b
+
+def alloff(b):
+    b.setall({'sel' : 'input'})
+
+def enable(b, k):
+    b.set_resonator({'sel' : 'resonator', 'channel' : k, 'dds_freq' : 0.01})
+
+def test_alloff_enable_alloff():
+    b = kidsim()
+    k = 19
+    alloff(b)
+    assert b.mmio.array.pulses == b.L
+
+    enable(b, k)
+    assert b.mmio.array.pulses == b.L + 1
+
+    # The lane of the enabled channel must be written again.
+    alloff(b)
+    assert b.mmio.array.pulses == b.L + 2
+    assert b.dict['shadow'][k % b.L][8:] == (AxisKidsimV3.OUTSEL['input'], 0)
+
+def test_enable_alloff_enable():
+    b = kidsim()
+    k = 19
+    enable(b, k)
+    alloff(b)
+    n = b.mmio.array.pulses
+
+    # Re-enabling the same channel must not be skipped.
+    b.write_regs(b.resonator_regs(k, dds_freq=0.01))
+    assert b.mmio.array.pulses == n + 1
+    assert b.dict['shadow'][k % b.L][8:] == (AxisKidsimV3.OUTSEL['resonator'], k // b.L)
+
+def test_unchanged_lane_skipped():
+    b = kidsim()
+    alloff(b)
+    alloff(b)
+    assert b.mmio.array.pulses == b.L
+    assert b.dict['writes']['elided'] == b.L
@@ -0,0 +1,47 @@
+"""
+KidsChain.phase_fit: piecewise linear phase fits between PFB channel jumps.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import conftest
+from pfbs import KidsChain
+
+def phase(n=300, m=0.5, jumps=(100, 200), jv=3.0):
+    f = np.linspace(500, 510, n)
+    phi = m*f
+    for j in jumps:
+        phi[j+1:] += jv
+    return f, phi
+
+def fit(*args, **kwargs):
+    return KidsChain.phase_fit(object.__new__(KidsChain), *args, **kwargs)
+
+def test_sections_between_jumps():
+    f, phi = phase()
+    data = fit(f, phi, gap=5)
+
+    assert set(data['jump'].keys()) == {'threshold', 'index', 'value'}
+    assert list(data['jump']['index']) == [100, 200]
+    assert np.allclose(data['jump']['value'], 3.0 + 0.5*(f[1]-f[0]))
+
+    assert data['fits']['valid'].all()
+    assert np.allclose(data['fits']['slope'], 0.5)
+    assert np.allclose(data['data']['fn'][data['data']['valid']], phi[data['data']['valid']])
+
+def test_section_too_close_to_edge_is_marked():
+    f, phi = phase(jumps=(3, 200))
+    data = fit(f, phi, gap=5)
+
+    fits = data['fits']
+    assert list(fits['valid']) == [False, True, True]
+    assert fits['npoints'][0] == 0
+    assert np.isnan(fits['slope'][0])
+    assert np.allclose(fits['slope'][fits['valid']], 0.5)
+
+def test_overall_fit():
+    f, phi = phase(jumps=())
+    data = fit(f, phi, jumps=False)
+    assert len(data['fits']) == 1
+    assert data['fits']['slope'][0] == pytest.approx(0.5)
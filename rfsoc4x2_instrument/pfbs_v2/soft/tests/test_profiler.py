@@ -0,0 +1,38 @@
+"""
+StartupProfiler: driver constructors are recorded in the order they run, once per driver.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from conftest import description
+from drivers.ip import SocIp, StartupProfiler
+
+class Base(SocIp):
+    def __init__(self, description):
+        super().__init__(description)
+
+class Derived(Base):
+    def __init__(self, description):
+        super().__init__(description)
+
+def test_drivers_in_construction_order():
+    prof = StartupProfiler()
+    prof.start()
+    try:
+        Derived(description('b'))
+        Base(description('a'))
+    finally:
+        prof.stop()
+
+    # The nested Base constructor of Derived is not recorded on its own.
+    assert list(prof.drivers) == ['b', 'a']
+    assert StartupProfiler.active is None
+
+def test_disabled():
+    prof = StartupProfiler(enabled=False)
+    prof.start()
+    with prof.section('phase'):
+        Base(description('a'))
+    prof.stop()
+    assert prof.phases == {} and prof.drivers == {}
@@ -0,0 +1,21 @@
+"""
+SimuChain.replay: replaying before compile_states gives a clear error.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import conftest
+from pfbs import SimuChain
+
+class Analysis:
+    def get_mixer_frequency(self):
+        return 1000.0
+
+def test_replay_without_states():
+    chain = object.__new__(SimuChain)
+    chain.analysis = Analysis()
+    chain.states = []
+    chain.states_fmix = None
+    with pytest.raises(RuntimeError, match="no states compiled"):
+        chain.replay(0)
@@ -0,0 +1,47 @@
+"""
+KidsChain.search: a broad resonance is reported once.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import conftest
+from pfbs import KidsChain
+
+class Analysis:
+    def set_decimation(self, value):
+        pass
+
+    def source(self, source):
+        pass
+
+class Chain(KidsChain):
+    # Chain measuring a simulated transmission with a broad dip, without hardware.
+    def __init__(self, f0, width, fr=0.001):
+        self.fr = fr
+        self.analysis = Analysis()
+        self.f0 = f0
+        self.width = width
+
+    def set_window(self, **kwargs):
+        pass
+
+    def measure_points(self, f_v, g=0.5, verbose=False):
+        f = np.array([self.fq(x) for x in f_v])
+        # Flat bottom: every point of the dip is a local minimum.
+        a = np.where(np.abs(f - self.f0) < self.width/2, 0.1, 1.0)
+        return f, a, np.zeros(len(f))
+
+def test_find_candidates_merges_runs():
+    f = np.linspace(0, 1, 11)
+    a = np.ones(11)
+    a[[4, 5, 8]] = [0.1, 0.1, 0.3]
+    idx = KidsChain.find_candidates(object.__new__(KidsChain), f, a, np.zeros(11), phase=False)
+    assert list(idx) == [4, 8]
+
+def test_broad_resonance_reported_once():
+    # Dip several coarse steps wide.
+    chain = Chain(f0=500.3, width=0.5)
+    data = chain.search(495, 505, N=101, phase=False, set_mixer=False, showProgress=False)
+    assert len(data['freq']) == 1
+    assert abs(data['freq'][0] - 500.3) <= 0.25
@@ -3,6 +3,12 @@ Support classes for dealing with FPGA IP blocks.
 """
 from pynq.overlay import DefaultIP
 import numpy as np
+import os
+import json
+import time
+import hashlib
+import functools
+from contextlib import contextmanager
 
 class DummyIp:
     """Stores the configuration constants for a firmware IP block.
@@ -27,6 +33,12 @@ class SocIp(DefaultIP, DummyIp):
     """
     REGISTERS = {}
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Driver constructors are timed while a StartupProfiler is active.
+        if '__init__' in cls.__dict__:
+            cls.__init__ = StartupProfiler.timed_init(cls.__dict__['__init__'])
+
     def __init__(self, description):
         """
         Constructor method
@@ -68,12 +80,33 @@ class SocIp(DefaultIP, DummyIp):
         except KeyError:
             return super().__getattribute__(a)
 
+    def trace_connections(self, soc):
+        """
+        Runs configure_connections() and returns the connection state it produced (HAS_* flags and new
+        dictionary entries), so it can be cached and restored with restore_connections().
+        """
+        before = dict(self.dict)
+        self.configure_connections(soc)
+
+        has = {k : v for k, v in vars(self).items() if k.startswith('HAS_')}
+        d   = {k : v for k, v in self.dict.items() if k not in before or before[k] is not v}
+        return {'has' : has, 'dict' : d}
+
+    def restore_connections(self, soc, conn):
+        """
+        Restores the connection state returned by trace_connections() without tracing the HWH.
+        """
+        self.soc = soc
+        for k, v in conn['has'].items():
+            setattr(self, k, v)
+        self.dict.update(conn['dict'])
+
 class QickMetadata:
     """
     Provides information about the connections between IP blocks, extracted from the HWH file.
     The HWH parser is very different between PYNQ 2.6/2.7 and 3.0+, so this class serves as a common interface.
     """
-    def __init__(self, soc):
+    def __init__(self, soc, cache=None):
         # We will use the HWH parser to extract information about signal connections between blocks.
         # system graph object, if available
         self.systemgraph = None
@@ -91,10 +124,53 @@ class QickMetadata:
             self.sigparser = soc.parser
             # Since the HWH parser doesn't parse buses, we also make our own BusParser.
             self.xml = soc.parser.root
+        self.timestamp = self.xml.get('TIMESTAMP')
+
+        # Cached topology (if any) for this HWH. The key hashes the HWH file, so it is only computed with a cache.
+        self.key = None
+        self.cached = None
+        if cache is not None:
+            self.key = HwhCache.key(soc, self.timestamp)
+            self.cached = cache.load(self.key)
+
         # TODO: We shouldn't need to use BusParser for PYNQ 3.0, but we think there's a bug in how pynqmetadata handles axis_switch.
-        self.busparser = BusParser(self.xml)
+        if self.cached is None:
+            self.busparser = BusParser(self.xml)
+        else:
+            self.busparser = BusParser.from_tables(self.cached['metadata']['bus'])
 
-        self.timestamp = self.xml.get('TIMESTAMP')
+        # Index of module parameters and clock frequencies, built on first use.
+        self.params = None
+        self.fclks = None
+        if self.cached is not None and 'params' in self.cached['metadata']:
+            self.params = self.cached['metadata']['params']
+            self.fclks = self.cached['metadata']['fclks']
+
+    def tables(self):
+        """
+        Returns the parsed HWH tables in a JSON-serializable form.
+        """
+        self.build_index()
+        return {'bus' : self.busparser.tables(), 'params' : self.params, 'fclks' : self.fclks}
+
+    def build_index(self):
+        """
+        Builds the module -> {parameter : value} and module -> {port : clock frequency} dictionaries
+        with a single pass over the HWH modules.
+        """
+        if self.params is not None:
+            return
+
+        params = {}
+        fclks = {}
+        for module in self.xml.findall('./MODULES/MODULE'):
+            fullpath = module.get('FULLNAME').lstrip('/')
+            params[fullpath] = {par.get('NAME') : par.get('VALUE')
+                                for par in module.findall('./PARAMETERS/PARAMETER')}
+            fclks[fullpath] = {port.get('NAME') : float(port.get('CLKFREQUENCY'))/1e6
+                               for port in module.findall('./PORTS/PORT') if port.get('CLKFREQUENCY') is not None}
+        self.params = params
+        self.fclks = fclks
 
     def trace_sig(self, blockname, portname):
         if self.systemgraph is not None:
@@ -148,10 +224,8 @@ class QickMetadata:
         :return: frequency in MHz
         :rtype: float
         """
-        xmlpath = "./MODULES/MODULE[@FULLNAME='/{0}']/PORTS/PORT[@NAME='{1}']".format(
-            blockname, portname)
-        port = self.xml.find(xmlpath)
-        return float(port.get('CLKFREQUENCY'))/1e6
+        self.build_index()
+        return self.fclks[blockname][portname]
 
     def get_param(self, blockname, parname):
         """
@@ -166,10 +240,8 @@ class QickMetadata:
         :return: parameter value
         :rtype: string
         """
-        xmlpath = "./MODULES/MODULE[@FULLNAME='/{0}']/PARAMETERS/PARAMETER[@NAME='{1}']".format(
-            blockname, parname)
-        param = self.xml.find(xmlpath)
-        return param.get('VALUE')
+        self.build_index()
+        return self.params[blockname][parname]
 
     def mod2type(self, blockname):
         if self.systemgraph is not None:
@@ -179,7 +251,7 @@ class QickMetadata:
 class BusParser:
     """Parses the HWH XML file to extract information on the buses connecting IP blocks.
     """
-    def __init__(self, root):
+    def __init__(self, root=None):
         """
         Matching all the buses in the modules from the HWH file.
         This is essentially a copy of the HWH parser's match_nets() and match_pins(),
@@ -187,11 +259,13 @@ class BusParser:
 
         In addition, there's a map from module names to module types.
 
-        :param root: HWH XML tree (from Overlay.parser.root)
+        :param root: HWH XML tree (from Overlay.parser.root). If None, the tables are left empty.
         """
         self.nets = {}
         self.pins = {}
         self.mod2type = {}
+        if root is None:
+            return
         for module in root.findall('./MODULES/MODULE'):
             fullpath = module.get('FULLNAME').lstrip('/')
             self.mod2type[fullpath] = module.get('MODTYPE')
@@ -204,6 +278,142 @@ class BusParser:
                 else:
                     self.nets[busname] = set([port])
 
+    def tables(self):
+        return {'nets'      : {k : sorted(v) for k, v in self.nets.items()},
+                'pins'      : self.pins,
+                'mod2type'  : self.mod2type}
+
+    @classmethod
+    def from_tables(cls, tables):
+        parser = cls()
+        parser.nets     = {k : set(v) for k, v in tables['nets'].items()}
+        parser.pins     = dict(tables['pins'])
+        parser.mod2type = dict(tables['mod2type'])
+        return parser
+
+class HwhCache:
+    """
+    Persistent cache of the HWH topology: parsed bus tables, traced IP connections and chain configuration.
+    Entries are JSON files keyed by the HWH hash and TIMESTAMP, so the HWH is only walked when the firmware changes.
+    """
+    def __init__(self, path="./hwh_cache"):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(soc, timestamp):
+        h = hashlib.sha1(str(timestamp).encode())
+
+        # Hash the HWH file itself, if we can find it.
+        bitfile = getattr(soc, 'bitfile_name', None)
+        if bitfile is not None:
+            hwh = os.path.splitext(bitfile)[0] + '.hwh'
+            if os.path.isfile(hwh):
+                with open(hwh, 'rb') as f:
+                    h.update(f.read())
+
+        return h.hexdigest()[:16]
+
+    def filename(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def load(self, key):
+        try:
+            with open(self.filename(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, entry):
+        # Write to a temporary file first so an interrupted save does not corrupt the entry.
+        fn = self.filename(key)
+        with open(fn + ".tmp", 'w') as f:
+            json.dump(entry, f)
+        os.replace(fn + ".tmp", fn)
+
+    def invalidate(self, key=None):
+        if key is None:
+            for fn in os.listdir(self.path):
+                if fn.endswith(".json"):
+                    os.remove(os.path.join(self.path, fn))
+        elif os.path.isfile(self.filename(key)):
+            os.remove(self.filename(key))
+
+class StartupProfiler:
+    """
+    Opt-in wall time profiler for the board bring-up: time per startup phase and per IP driver constructor.
+    When disabled, section() does nothing and no driver is recorded.
+    """
+    # Profiler recording the driver constructors (see SocIp), set between start() and stop().
+    active = None
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = {}
+        self.drivers = {}
+
+        # Drivers whose constructor is being timed.
+        self.running = set()
+
+    def start(self):
+        # Record the constructor of every driver created from now on, in the order the startup creates them.
+        StartupProfiler.active = self if self.enabled else None
+
+    def stop(self):
+        StartupProfiler.active = None
+
+    @contextmanager
+    def section(self, name, group='phases'):
+        """
+        Times the enclosed block and adds it to group ('phases' or 'drivers') under name.
+        """
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            times = getattr(self, group)
+            times[name] = times.get(name, 0) + time.perf_counter() - t0
+
+    @staticmethod
+    def timed_init(init):
+        # Wraps a driver constructor so the active profiler records it (outermost constructor only).
+        @functools.wraps(init)
+        def __init__(self, description, *args, **kwargs):
+            prof = StartupProfiler.active
+            name = description['fullpath']
+            if prof is None or name in prof.running:
+                return init(self, description, *args, **kwargs)
+
+            prof.running.add(name)
+            try:
+                with prof.section(name, 'drivers'):
+                    return init(self, description, *args, **kwargs)
+            finally:
+                prof.running.discard(name)
+        return __init__
+
+    def report(self):
+        """
+        Returns the recorded times (seconds), sorted from slowest to fastest.
+        """
+        return {'total'     : sum(self.phases.values()),
+                'phases'    : dict(sorted(self.phases.items(), key=lambda x: -x[1])),
+                'drivers'   : dict(sorted(self.drivers.items(), key=lambda x: -x[1]))}
+
+    def __str__(self):
+        rep = self.report()
+        lines = ["Startup: %.3f s" % rep['total']]
+        lines.append("\tPhases:")
+        for k, v in rep['phases'].items():
+            lines.append("\t\t%-40s %8.3f s" % (k, v))
+        lines.append("\tDrivers:")
+        for k, v in rep['drivers'].items():
+            lines.append("\t\t%-40s %8.3f s" % (k, v))
+        return "\n".join(lines)
+
 class QickConfig():
     """Uses the QICK configuration to convert frequencies and clock delays.
     If running on the QICK, you don't need to use this class - the QickSoc class has all of the same methods.
@@ -2,6 +2,7 @@ import numpy as np
 from pynq.buffer import allocate
 from .ip import SocIp
 import time
+import asyncio
 
 class MrBufferEt(SocIp):
     # Registers.
@@ -203,6 +204,9 @@ class AxisBufferUram(SocIp):
     def configure(self, dma, sync = "no"):
         self.dma = dma
 
+        # DMA buffer, allocated once.
+        self.buff = allocate(shape=(self.BUFFER_LENGTH,), dtype=np.uint64)
+
         if sync == "no":
             self.sync_reg = 0
         elif sync == "yes":
@@ -223,38 +227,36 @@ class AxisBufferUram(SocIp):
         # Enable read operation.
         self.rw_reg = 0        
         
-        # Define buffer:         
-        buff = allocate(shape=(self.BUFFER_LENGTH,), dtype=np.uint64)
-
         # Start transfer.
         self.start_reg = 1
 
         # DMA data.
-        self.dma.recvchannel.transfer(buff)
+        self.dma.recvchannel.transfer(self.buff)
         self.dma.recvchannel.wait()
 
         # Stop transfer.
         self.start_reg = 0
         
-        return buff
+        # Copy out of the DMA buffer, which is reused by the next transfer.
+        return np.array(self.buff)
         
     def transfer(self):
         # Enable read operation.
         self.rw_reg = 0        
         
-        # Define buffer:         
-        buff = allocate(shape=(self.BUFFER_LENGTH,), dtype=np.uint64)
-
         # Start transfer.
         self.start_reg = 1
 
         # DMA data.
-        self.dma.recvchannel.transfer(buff)
+        self.dma.recvchannel.transfer(self.buff)
         self.dma.recvchannel.wait()
 
         # Stop transfer.
         self.start_reg = 0
         
+        # Decoding makes new arrays, so the DMA buffer can be reused.
+        buff = self.buff
+
         # Format buffer:
         # Even samples, IQ.
         # Lower 32 bits: I
@@ -291,6 +293,16 @@ class AxisAccumulatorV6(SocIp):
                     'round_cnt_reg'         :13, 
                     'epoch_cnt_reg'         :14, 
                     'transmitting_reg'      :15}
+
+    # Completion polling: fraction of the predicted averaging time to sleep, then spin from
+    # POLL_MIN seconds with exponential back-off up to POLL_MAX seconds.
+    SLEEP_FRAC  = 0.9
+    POLL_MIN    = 1e-5
+    POLL_MAX    = 0.01
+
+    # Completion timeout: TIMEOUT_FACTOR times the predicted averaging time, at least TIMEOUT_MIN seconds.
+    TIMEOUT_FACTOR  = 10
+    TIMEOUT_MIN     = 1
         
     def __init__(self, description):
         # Initialize ip
@@ -338,8 +350,40 @@ class AxisAccumulatorV6(SocIp):
         # Define buffer:         
         self.buff = allocate(shape=(self.BUFFER_LENGTH,2), dtype=np.int64)
 
-    def configure(self, dma):
+        # Sampling rate of each FFT input (MHz), used to predict the averaging time.
+        self.fs = None
+
+    def configure(self, dma, fs=None):
         self.dma = dma
+        self.fs = fs
+
+    def avg_time(self, N=1):
+        """
+        Predicted averaging time (seconds) of N FFT frames, or None if the sampling rate is not configured.
+        """
+        if self.fs is None:
+            return None
+        return N * 2**self.FFT_AW / (self.fs*1e6)
+
+    def timeout(self, N=1):
+        # Maximum time (seconds) to wait for N averages.
+        tavg = self.avg_time(N)
+        if tavg is None:
+            return self.TIMEOUT_MIN
+        return max(self.TIMEOUT_FACTOR*tavg, self.TIMEOUT_MIN)
+
+    def wait_intervals(self, N=1):
+        # Sleep intervals while waiting for N averages: most of the predicted time first, then back-off polling.
+        # Raises RuntimeError once the timeout is exceeded.
+        deadline = time.monotonic() + self.timeout(N)
+        tavg = self.avg_time(N)
+        if tavg is not None:
+            yield self.SLEEP_FRAC*tavg
+        dt = self.POLL_MIN
+        while time.monotonic() < deadline:
+            yield dt
+            dt = min(2*dt, self.POLL_MAX)
+        raise RuntimeError("%s: accumulator did not finish %d averages in %f s" % (self.fullpath, N, self.timeout(N)))
 
     def start(self):
         self.process_reg = 1
@@ -354,41 +398,93 @@ class AxisAccumulatorV6(SocIp):
         # Start.
         self.start()
         
-        # Wait until average is done.
-        while not self.transmitting():
-            time.sleep(0.1)
+        # Wait until average is done (the block is stopped also on timeout).
+        try:
+            self.wait(N)
+        finally:
+            # Stop block.
+            self.stop()
         
-        # Stop block.
-        self.stop()
+        # Transfer data.
+        return self.transfer()
+
+    async def single_shot_async(self, N=1):
+        """
+        Same as single_shot(), but waits with asyncio so other tasks can run during the average.
+        """
+        # Set number of averages.
+        self.setavg(N)
+        
+        # Start.
+        self.start()
+        
+        # Wait until average is done (the block is stopped also on timeout or cancellation).
+        try:
+            await self.wait_async(N)
+        finally:
+            # Stop block.
+            self.stop()
         
         # Transfer data.
         return self.transfer()
 
+    def wait(self, N=1):
+        # Wait until N averages are done.
+        for dt in self.wait_intervals(N):
+            if self.transmitting():
+                break
+            time.sleep(dt)
+
+    async def wait_async(self, N=1):
+        # Wait until N averages are done, letting other tasks run.
+        for dt in self.wait_intervals(N):
+            if self.transmitting():
+                break
+            await asyncio.sleep(dt)
+
     def setavg(self, N = 100):
         self.usr_round_samples_reg  = N
 
     def transmitting(self):
         return self.transmitting_reg
 
-    def transfer(self):
+    def transfer(self, out=None, exact=False):
+        """
+        Transfers and decodes the accumulated bins, averaged over the number of samples.
+
+        :param out: output array of BUFFER_LENGTH-1 elements to decode into (reused by the caller), e.g.
+        np.longdouble for more precision. Defaults to a new float64 array.
+        :type out: array
+        :param exact: also return the exact integer pair (high, low) and the number of samples.
+        high (int64) and low (uint64) are views of the DMA buffer, valid until the next transfer.
+        :type exact: bool
+        :return: averaged bins, or (averaged bins, (high, low, nsamp)) if exact.
+        """
         # DMA data.
         self.dma.recvchannel.transfer(self.buff)
         self.dma.recvchannel.wait()
         
         # Format data:
-        # First dimension: Lower 64 bits.
+        # First dimension: Lower 64 bits (unsigned).
         # Second dimension: Upper 64 bts.
         # Last sample: Meta Data.
-        s_low = self.buff[:-1,0]
-        s_low = s_low.astype(np.float64)
-        s_high = self.buff[:-1,1]
-        s_high = s_high.astype(np.float64)
-        samples = s_low + (2**64 * s_high).astype(np.float64)
+        s_low   = self.buff[:-1,0].view(np.uint64)
+        s_high  = self.buff[:-1,1]
         meta0   = self.buff[-1,0]
         meta1   = self.buff[-1,1]
         nsamp = meta0 >> np.int64(32)
 
-        return samples/nsamp
+        # samples = (high*2**64 + low)/nsamp, computed in place.
+        if out is None:
+            out = np.empty(self.BUFFER_LENGTH-1, dtype=np.float64)
+        np.multiply(s_high, out.dtype.type(2**64), out=out)
+        np.add(out, s_low, out=out)
+        np.divide(out, nsamp, out=out)
+
+        if exact:
+            return out, (s_high, s_low, int(nsamp))
+
+        return out
 
 
 
@@ -21,10 +21,70 @@ def findPeak(x,y,xmin=-1,xmax=-1):
     return Xmax, Ymax        
 
 # Sort FFT data. Output FFT is bit-reversed. Index is given by idx array.
-def sort_br(x, idx):
-    x_sort = np.zeros(len(x)) + 1j*np.zeros(len(x))
-    for i in np.arange(len(x)):
-        x_sort[idx[i]] = x[i]
+def sort_br(x, idx, out=None):
+    if out is None:
+        out = np.zeros(len(x), dtype=np.complex128)
+    out[idx] = x
 
-    return x_sort    
+    return out
+
+class SortBr:
+    """
+    Sorts bit-reversed FFT data. The permutation is taken from the index stream and only rebuilt when the
+    index stream changes. Returns a new array unless a buffer is given with out (which is then overwritten).
+    """
+    def __init__(self, dtype=np.complex128):
+        self.dtype = dtype
+        self.idx = None
+
+    def __call__(self, xi, xq, idx, out=None):
+        if self.idx is None or not np.array_equal(self.idx, idx):
+            self.idx = np.array(idx, dtype=np.intp)
+
+        if out is None:
+            out = np.zeros(len(self.idx), dtype=self.dtype)
+
+        # Scatter I/Q into the sorted buffer.
+        out.real[self.idx] = xi
+        out.imag[self.idx] = xq
+
+        return out
         
+
+class Waterfall:
+    """
+    Fixed-size ring buffer of spectra. Rows are stored as produced by the hardware and the frequency
+    ordering is applied as an index offset: frequency bin k of a row is row[(k + shift) % nbins].
+    """
+    def __init__(self, depth, nbins, shift=0, dtype=np.float64):
+        self.data = np.zeros((depth, nbins), dtype=dtype)
+        self.shift = shift
+        self.count = 0
+
+    @property
+    def depth(self):
+        return self.data.shape[0]
+
+    def next_row(self):
+        # Row to be written by the next spectrum.
+        return self.data[self.count % self.depth]
+
+    def push(self):
+        self.count += 1
+
+    def rows(self):
+        # Ring rows in chronological order (oldest first).
+        n = min(self.count, self.depth)
+        return np.arange(self.count - n, self.count) % self.depth
+
+    def spectrum(self, i=-1):
+        """
+        Spectrum i in frequency order (i=-1 is the latest).
+        """
+        return np.roll(self.data[self.rows()[i]], -self.shift)
+
+    def image(self):
+        """
+        All stored spectra in chronological and frequency order.
+        """
+        return np.roll(self.data[self.rows()], -self.shift, axis=1)
@@ -0,0 +1,58 @@
+import os
+import sys
+import types
+
+# Tests import the drivers as top.py does (soft/ on the path).
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Off-board, the hardware packages are replaced by minimal stand-ins so the numpy paths of the drivers can be
+# tested: register maps are backed by a plain array and DMA buffers by numpy arrays.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def stub(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+class Mmio:
+    def __init__(self, n=64):
+        self.array = np.zeros(n, dtype=np.uint32)
+
+class DefaultIP:
+    def __init__(self, description):
+        self.mmio = Mmio()
+
+class Overlay:
+    pass
+
+class RFdc(DefaultIP):
+    pass
+
+def allocate(shape, dtype):
+    return np.zeros(shape, dtype=dtype)
+
+if np is not None:
+    try:
+        import pynq
+    except ImportError:
+        pynq = stub('pynq')
+        pynq.overlay = stub('pynq.overlay', DefaultIP=DefaultIP, Overlay=Overlay)
+        pynq.buffer = stub('pynq.buffer', allocate=allocate)
+
+    try:
+        import xrfdc
+    except ImportError:
+        stub('xrfdc', RFdc=RFdc, EVENT_MIXER=0)
+
+    try:
+        import xrfclk
+    except ImportError:
+        stub('xrfclk')
+
+def description(name, **parameters):
+    # IP description as found in Overlay.ip_dict.
+    return {'fullpath' : name, 'type' : 'user.org:user:%s:1.0' % name, 'parameters' : {k : str(v) for k, v in parameters.items()}}
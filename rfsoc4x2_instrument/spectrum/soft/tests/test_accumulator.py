@@ -0,0 +1,82 @@
+"""
+AxisAccumulatorV6 bin decoding: 128-bit sums (signed high word, unsigned low word) averaged over nsamp.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from conftest import description
+from drivers.misc import AxisAccumulatorV6
+
+class Dma:
+    # DMA receive channel returning a fixed buffer.
+    def __init__(self, data):
+        self.data = data
+        self.recvchannel = self
+
+    def transfer(self, buff):
+        buff[:] = self.data
+
+    def wait(self):
+        pass
+
+def accumulator():
+    return AxisAccumulatorV6(description('axis_accumulator_v1', AXIS_IN_DW=64, AXIS_OUT_DW=128, FFT_AW=15,
+        BANK_ARRAY_AW=4, MEM_DW=128, MEM_PIPE=2, FFT_STORE=1, IQ_FORMAT=1))
+
+def buffer(acc, nsamp, seed=0):
+    rng = np.random.default_rng(seed)
+    n = acc.BUFFER_LENGTH - 1
+    data = np.zeros((acc.BUFFER_LENGTH, 2), dtype=np.int64)
+    # Low words cover the full unsigned range (negative as int64), high words are small.
+    data[:-1,0] = rng.integers(-2**63, 2**63, n, dtype=np.int64)
+    data[:-1,1] = rng.integers(0, 4, n)
+    data[-1,0] = nsamp << 32
+    return data
+
+def expected(data, nsamp, i):
+    low = int(data[i,0]) & (2**64 - 1)
+    return (int(data[i,1])*2**64 + low)/nsamp
+
+def test_decode_unsigned_low_word():
+    acc = accumulator()
+    data = buffer(acc, nsamp=1000)
+    acc.configure(Dma(data))
+    x = acc.transfer()
+    for i in [0, 1, 7, 1000, len(x)-1]:
+        assert x[i] == pytest.approx(expected(data, 1000, i), rel=1e-15)
+
+def test_exact_words():
+    acc = accumulator()
+    data = buffer(acc, nsamp=3)
+    acc.configure(Dma(data))
+    x, (high, low, nsamp) = acc.transfer(exact=True)
+    assert nsamp == 3
+    assert low.dtype == np.uint64
+    assert int(high[5])*2**64 + int(low[5]) == int(data[5,1])*2**64 + (int(data[5,0]) & (2**64 - 1))
+
+def test_transfers_return_new_arrays():
+    acc = accumulator()
+    dma = Dma(buffer(acc, nsamp=10, seed=0))
+    acc.configure(dma)
+    x0 = acc.transfer()
+    kept = x0.copy()
+    dma.data = buffer(acc, nsamp=10, seed=1)
+    x1 = acc.transfer()
+    assert x1 is not x0
+    assert np.array_equal(x0, kept)
+
+def test_out_buffer():
+    acc = accumulator()
+    acc.configure(Dma(buffer(acc, nsamp=7)))
+    out = np.empty(acc.BUFFER_LENGTH-1, dtype=np.float64)
+    assert acc.transfer(out=out) is out
+
+def test_timeout_stops_accumulator():
+    acc = accumulator()
+    acc.configure(Dma(buffer(acc, nsamp=1)), fs=1e6)
+    acc.TIMEOUT_MIN = 0.01
+    # transmitting_reg never set: the wait times out.
+    with pytest.raises(RuntimeError):
+        acc.single_shot(N=1)
+    assert acc.process_reg == 0
@@ -0,0 +1,43 @@
+"""
+Bit-reversal reordering of XFFT captures.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from helpers import SortBr, sort_br
+
+def capture(n=1024, seed=0):
+    rng = np.random.default_rng(seed)
+    idx = rng.permutation(n).astype(np.uint16)
+    xi = rng.integers(-2**31, 2**31, n).astype(np.int32)
+    xq = rng.integers(-2**31, 2**31, n).astype(np.int32)
+    return xi, xq, idx
+
+def reference(xi, xq, idx):
+    x = np.zeros(len(xi), dtype=np.complex128)
+    for i in range(len(xi)):
+        x[idx[i]] = xi[i] + 1j*xq[i]
+    return x
+
+def test_sort_matches_reference_exactly():
+    xi, xq, idx = capture()
+    x = SortBr()(xi, xq, idx)
+    assert x.dtype == np.complex128
+    assert np.array_equal(x, reference(xi, xq, idx))
+    assert np.array_equal(sort_br(xi + 1j*xq, idx), x)
+
+def test_results_are_not_shared():
+    s = SortBr()
+    xi, xq, idx = capture(seed=0)
+    x0 = s(xi, xq, idx)
+    kept = x0.copy()
+    s(*capture(seed=1))
+    assert np.array_equal(x0, kept)
+
+def test_out_buffer_is_reused():
+    s = SortBr()
+    out = np.zeros(1024, dtype=np.complex128)
+    xi, xq, idx = capture()
+    assert s(xi, xq, idx, out=out) is out
+    assert np.array_equal(out, reference(xi, xq, idx))
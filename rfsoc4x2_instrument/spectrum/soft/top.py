@@ -7,19 +7,27 @@ import numpy as np
 from drivers.ip import *
 from drivers.pfb import *
 from drivers.misc import *
-from drivers.ip import SocIp, QickMetadata, QickConfig
+from drivers.ip import SocIp, QickMetadata, QickConfig, HwhCache, StartupProfiler
 from helpers import *
 
 
 class RFDC(xrfdc.RFdc):
     """
     Extends the xrfdc driver.
-    Since operations on the RFdc tend to be slow (tens of ms), we cache the Nyquist zone and frequency.
+    Since operations on the RFdc tend to be slow (tens of ms), we cache the Nyquist zone and the complete mixer
+    settings of each block. The cache is filled on first read and updated on every write, so chains never need
+    to read back from the hardware.
     """
     bindto = ["xilinx.com:ip:usp_rf_data_converter:2.3",
               "xilinx.com:ip:usp_rf_data_converter:2.4",
               "xilinx.com:ip:usp_rf_data_converter:2.6"]
 
+    # Tile event source (see event_dict of the chains).
+    EVNT_SRC_TILE = 2
+
+    # Fine mixer NCO frequency bits.
+    B_NCO = 48
+
     def __init__(self, description):
         """
         Constructor method
@@ -28,106 +36,149 @@ class RFDC(xrfdc.RFdc):
         # Dictionary for configuration.
         self.dict = {}
 
-        # Initialize nqz and freq.
-        self.dict['nqz']  = {'adc' : {}, 'dac' : {}}
-        self.dict['freq'] = {'adc' : {}, 'dac' : {}}
+        # Initialize nqz, freq and mixer settings.
+        self.dict['nqz']   = {'adc' : {}, 'dac' : {}}
+        self.dict['freq']  = {'adc' : {}, 'dac' : {}}
+        self.dict['mixer'] = {'adc' : {}, 'dac' : {}}
+
+        # Counters of performed/elided operations.
+        self.reset_stats()
 
     def configure(self, soc):
         self.dict['cfg'] = {'adc' : soc.adcs, 'dac' : soc.dacs}
 
-    def set_mixer_freq(self, blockid, f, blocktype='dac'):
-        # Get config.
-        cfg = self.dict['cfg'][blocktype]
+    def reset_stats(self):
+        self.dict['stats'] = {  'mixer' : {'performed' : 0, 'elided' : 0},
+                                'nqz'   : {'performed' : 0, 'elided' : 0}}
+
+    @property
+    def stats(self):
+        """
+        Number of performed and elided RFDC mixer and Nyquist zone writes.
+        """
+        return {k : dict(v) for k, v in self.dict['stats'].items()}
 
-        # Check Nyquist zone.
-        fs = cfg[blockid]['fs']
-        if abs(f) > fs/2 and self.get_nyquist(blockid, blocktype)==2:
-            fset *= -1
+    def nco_word(self, blockid, f, blocktype='dac'):
+        # Quantized NCO frequency.
+        fs = self.dict['cfg'][blocktype][blockid]['fs']
+        return int(round(f/fs*2**self.B_NCO))
 
+    def get_block(self, blockid, blocktype='dac'):
         # Get tile and channel from id.
         tile, channel = [int(a) for a in blockid]
 
-        # Get Mixer Settings.
         if blocktype == 'adc':
-            m_set = self.adc_tiles[tile].blocks[channel].MixerSettings
+            return self.adc_tiles[tile].blocks[channel]
         elif blocktype == 'dac':
-            m_set = self.dac_tiles[tile].blocks[channel].MixerSettings
+            return self.dac_tiles[tile].blocks[channel]
         else:
-            raise RuntimeError("Blocktype %s not recognized" & blocktype)
+            raise RuntimeError("Blocktype %s not recognized" % blocktype)
+
+    def get_mixer_settings(self, blockid, blocktype='dac'):
+        """
+        Returns the cached mixer settings of the block. Do not modify the returned dictionary.
+        """
+        try:
+            return self.dict['mixer'][blocktype][blockid]
+        except KeyError:
+            # Fill mixer dictionary.
+            m_set = dict(self.get_block(blockid, blocktype).MixerSettings)
+            self.dict['mixer'][blocktype][blockid] = m_set
+            self.dict['freq'][blocktype][blockid] = m_set['Freq']
 
-        # Make a copy of mixer settings.
-        m_set_copy = m_set.copy()
+            return m_set
 
-        # Update the copy
-        m_set_copy.update({
-            'Freq': f,
-            'PhaseOffset': 0})
+    def set_mixer_freq(self, blockid, f, blocktype='dac'):
+        self.set_mixer_freqs({(blocktype, blockid) : f})
 
-        # Update settings.
-        if blocktype == 'adc':
-            self.adc_tiles[tile].blocks[channel].MixerSettings = m_set_copy
-            self.adc_tiles[tile].blocks[channel].UpdateEvent(xrfdc.EVENT_MIXER)
-            self.dict['freq'][blocktype][blockid] = f
-        elif blocktype == 'dac':
-            self.dac_tiles[tile].blocks[channel].MixerSettings = m_set_copy
-            self.dac_tiles[tile].blocks[channel].UpdateEvent(xrfdc.EVENT_MIXER)
+    def set_mixer_freqs(self, freqs, tile_event=True, force=False):
+        """
+        Sets several ADC/DAC NCO frequencies and fires the update events together.
+
+        :param freqs: dictionary {(blocktype, blockid) : f}, e.g. {('adc','20') : -500, ('dac','01') : 500}.
+        :type freqs: dict
+        :param tile_event: when all the updated blocks of a tile use the tile event source, fire a single
+        tile-level event for them instead of one event per block. Only blocks of the same tile (and blocktype)
+        share an event, so an ADC and a DAC are always updated with one event each.
+        :type tile_event: boolean
+        :param force: write even if the quantized NCO frequency is unchanged.
+        :type force: boolean
+        """
+        # Write all the settings first.
+        tiles = {}
+        for (blocktype, blockid), f in freqs.items():
+            # Get config.
+            cfg = self.dict['cfg'][blocktype]
+
+            # Check Nyquist zone.
+            fs = cfg[blockid]['fs']
+            if abs(f) > fs/2 and self.get_nyquist(blockid, blocktype)==2:
+                fset = -f
+            else:
+                fset = f
+
+            # Need to update?
+            m_set = self.get_mixer_settings(blockid, blocktype)
+            if not force and m_set['PhaseOffset'] == 0 and \
+                    self.nco_word(blockid, fset, blocktype) == self.nco_word(blockid, m_set['Freq'], blocktype):
+                self.dict['stats']['mixer']['elided'] += 1
+                continue
+            self.dict['stats']['mixer']['performed'] += 1
+
+            # Make a copy of the cached mixer settings.
+            m_set_copy = m_set.copy()
+
+            # Update the copy
+            m_set_copy.update({
+                'Freq': fset,
+                'PhaseOffset': 0})
+
+            # Update settings.
+            block = self.get_block(blockid, blocktype)
+            block.MixerSettings = m_set_copy
+
+            # Update cache.
+            self.dict['mixer'][blocktype][blockid] = m_set_copy
             self.dict['freq'][blocktype][blockid] = f
-        else:
-            raise RuntimeError("Blocktype %s not recognized" & blocktype)
-        
+
+            # Group blocks by tile for the update events.
+            tiles.setdefault((blocktype, blockid[0]), []).append((block, m_set_copy['EventSource']))
+
+        # Fire update events.
+        for blocks in tiles.values():
+            if tile_event and all([src == self.EVNT_SRC_TILE for _, src in blocks]):
+                # One tile-level event updates all the blocks of the tile.
+                blocks[0][0].UpdateEvent(xrfdc.EVENT_MIXER)
+            else:
+                for block, _ in blocks:
+                    block.UpdateEvent(xrfdc.EVENT_MIXER)
 
     def get_mixer_freq(self, blockid, blocktype='dac'):
         try:
             return self.dict['freq'][blocktype][blockid]
         except KeyError:
-            # Get tile and channel from id.
-            tile, channel = [int(a) for a in blockid]
-
-            # Fill freq dictionary.
-            if blocktype == 'adc':
-                self.dict['freq'][blocktype][blockid] = self.adc_tiles[tile].blocks[channel].MixerSettings['Freq']
-            elif blocktype == 'dac':
-                self.dict['freq'][blocktype][blockid] = self.dac_tiles[tile].blocks[channel].MixerSettings['Freq']
-            else:
-                raise RuntimeError("Blocktype %s not recognized" & blocktype)
-
-            return self.dict['freq'][blocktype][blockid]
+            return self.get_mixer_settings(blockid, blocktype)['Freq']
 
     def set_nyquist(self, blockid, nqz, blocktype='dac', force=False):
         # Check valid selection.
         if nqz not in [1,2]:
             raise RuntimeError("Nyquist zone must be 1 or 2")
 
-        # Get tile and channel from id.
-        tile, channel = [int(a) for a in blockid]
-
         # Need to update?
         if not force and self.get_nyquist(blockid,blocktype) == nqz:
+            self.dict['stats']['nqz']['elided'] += 1
             return
+        self.dict['stats']['nqz']['performed'] += 1
 
-        if blocktype == 'adc':
-            self.adc_tiles[tile].blocks[channel].NyquistZone = nqz
-            self.dict['nqz'][blocktype][blockid] = nqz
-        elif blocktype == 'dac':
-            self.dac_tiles[tile].blocks[channel].NyquistZone = nqz
-            self.dict['nqz'][blocktype][blockid] = nqz
-        else:
-            raise RuntimeError("Blocktype %s not recognized" & blocktype)
+        self.get_block(blockid, blocktype).NyquistZone = nqz
+        self.dict['nqz'][blocktype][blockid] = nqz
 
     def get_nyquist(self, blockid, blocktype='dac'):
         try:
             return self.dict['nqz'][blocktype][blockid]
         except KeyError:
-            # Get tile and channel from id.
-            tile, channel = [int(a) for a in blockid]
-
             # Fill nqz dictionary.
-            if blocktype == 'adc':
-                self.dict['nqz'][blocktype][blockid] = self.adc_tiles[tile].blocks[channel].NyquistZone
-            elif blocktype == 'dac':
-                self.dict['nqz'][blocktype][blockid] = self.dac_tiles[tile].blocks[channel].NyquistZone
-            else:
-                raise RuntimeError("Blocktype %s not recognized" & blocktype)
+            self.dict['nqz'][blocktype][blockid] = self.get_block(blockid, blocktype).NyquistZone
 
             return self.dict['nqz'][blocktype][blockid]
 
@@ -159,6 +210,7 @@ class AnalysisChain():
         'mfs_div_4' : 8,
         'bypass' : 16
     }
+    coarse_lut = {v : key for key, v in coarse_dict.items()}
     
     # Mixer dictionary.
     mixer_dict = {
@@ -176,6 +228,10 @@ class AnalysisChain():
             'fine' : 2,
             'off' : 3,
         }}
+
+    # Reverse lookup tables (register value -> key).
+    event_lut = {k : {v : key for key, v in d.items()} for k, d in event_dict.items()}
+    mixer_lut = {k : {v : key for key, v in d.items()} for k, d in mixer_dict.items()}
     
     # Constructor.
     def __init__(self, soc, chain):
@@ -202,21 +258,24 @@ class AnalysisChain():
                 # pfb block.
                 pfb = getattr(self.soc, self.dict['chain']['pfb'])
 
+                # XFFT output reordering (cached permutation and buffer).
+                self.dict['sort_br'] = SortBr()
+
     def update_settings(self):
-        tile = int(self.dict['chain']['adc']['tile'])
-        ch = int(self.dict['chain']['adc']['ch'])
-        m_set = self.soc.rf.adc_tiles[tile].blocks[ch].MixerSettings
+        # Read from the RFDC cache (no hardware read-back).
+        blockid = self.dict['chain']['adc']['id']
+        m_set = self.soc.rf.get_mixer_settings(blockid, 'adc')
         self.dict['mixer'] = {
-            'mode'     : self.return_key(self.mixer_dict['mode'], m_set['MixerMode']),
-            'type'     : self.return_key(self.mixer_dict['type'], m_set['MixerType']),
-            'evnt_src' : self.return_key(self.event_dict['source'], m_set['EventSource']),
+            'mode'     : self.mixer_lut['mode'].get(m_set['MixerMode'], 'Key Not Found'),
+            'type'     : self.mixer_lut['type'].get(m_set['MixerType'], 'Key Not Found'),
+            'evnt_src' : self.event_lut['source'].get(m_set['EventSource'], 'Key Not Found'),
         }
 
         # Check type.
         if self.dict['mixer']['type'] == 'fine':
             self.dict['mixer']['freq'] = m_set['Freq']
         elif self.dict['mixer']['type'] == 'coarse':
-            type_c = self.return_key(self.coarse_dict, m_set['CoarseMixFreq'])
+            type_c = self.coarse_lut.get(m_set['CoarseMixFreq'], 'Key Not Found')
             fs_adc = self.soc.adcs[self.dict['chain']['adc']['id']]['fs']
             if type_c == 'fs_div_2':
                 freq = fs_adc/2
@@ -229,7 +288,7 @@ class AnalysisChain():
 
             self.dict['mixer']['freq'] = freq
                 
-        self.dict['nqz'] = self.soc.rf.adc_tiles[tile].blocks[ch].NyquistZone        
+        self.dict['nqz'] = self.soc.rf.get_nyquist(blockid, 'adc')
         
     def set_mixer_frequency(self, f):
         if self.dict['mixer']['type'] != 'fine':
@@ -293,7 +352,7 @@ class AnalysisChain():
         else:
             raise ValueError("Frequency value %f out of allowed range [%f,%f]" % (f,fmix-fs/2,fmix+fs/2))
 
-    def get_bin_xfft(self, f=0, verbose=False):
+    def get_bin_xfft(self, f=0, verbose=False, out=None):
         """
         Get data from the channel nearest to the specified frequency.
         
@@ -301,6 +360,8 @@ class AnalysisChain():
         :type f: float
         :param verbose: flag for verbose output.
         :type verbose: boolean
+        :param out: optional complex128 buffer to sort the data into (reused instead of a new array).
+        :type out: array
         :return: [i,q] data from the channel.
         :rtype:[array,array]
         """
@@ -325,8 +386,7 @@ class AnalysisChain():
 
             # Get data.
             [xi,xq,idx] = buff_b.get_data()
-            x = xi + 1j*xq
-            x = sort_br(x,idx)
+            x = self.dict['sort_br'](xi,xq,idx,out=out)
             return x.real,x.imag
                 
         else:
@@ -338,6 +398,62 @@ class AnalysisChain():
         x = acc_b.single_shot(N=N)
         x = np.roll(x, -int(self.soc.FFT_N/4))
         return x
+
+    def waterfall(self, N=1, depth=100, nspectra=None):
+        """
+        Continuous accumulator mode. The accumulator is re-armed right after each transfer and every
+        averaged spectrum is decoded directly into the next row of a ring buffer (see Waterfall).
+
+        :param N: number of averages per spectrum.
+        :type N: int
+        :param depth: number of spectra kept in the ring buffer.
+        :type depth: int
+        :param nspectra: stop after this many spectra (None runs until the generator is closed).
+        :type nspectra: int
+        :return: generator yielding the Waterfall after each new spectrum (wf.spectrum() is the latest).
+        """
+        acc_b, wf = self.waterfall_setup(N, depth)
+        try:
+            acc_b.start()
+            while nspectra is None or wf.count < nspectra:
+                acc_b.wait(N)
+                acc_b.stop()
+                acc_b.transfer(out=wf.next_row())
+                acc_b.start()
+                wf.push()
+                yield wf
+        finally:
+            acc_b.stop()
+
+    async def waterfall_async(self, N=1, depth=100, nspectra=None):
+        """
+        Async iterator version of waterfall().
+        """
+        acc_b, wf = self.waterfall_setup(N, depth)
+        try:
+            acc_b.start()
+            while nspectra is None or wf.count < nspectra:
+                await acc_b.wait_async(N)
+                acc_b.stop()
+                acc_b.transfer(out=wf.next_row())
+                acc_b.start()
+                wf.push()
+                yield wf
+        finally:
+            acc_b.stop()
+
+    def waterfall_setup(self, N, depth):
+        # Get blocks.
+        acc_b = getattr(self.soc, self.dict['chain']['accumulator'])
+
+        # Ring buffer. Frequency order is the one of get_data_acc, applied as an index offset.
+        wf = Waterfall(depth, acc_b.BUFFER_LENGTH-1, shift=int(self.soc.FFT_N/4))
+        self.dict['waterfall'] = wf
+
+        # Set number of averages.
+        acc_b.setavg(N)
+
+        return acc_b, wf
     
     def freq2ch(self, f):
         # Get blocks.
@@ -418,7 +534,11 @@ class SynthesisChain():
             'coarse' : 1,
             'fine' : 2,
             'off' : 3,
-        }}    
+        }}
+
+    # Reverse lookup tables (register value -> key).
+    event_lut = {k : {v : key for key, v in d.items()} for k, d in event_dict.items()}
+    mixer_lut = {k : {v : key for key, v in d.items()} for k, d in mixer_dict.items()}    
 
     # Constructor.
     def __init__(self, soc, chain):
@@ -443,17 +563,17 @@ class SynthesisChain():
                 self.update_settings()
 
     def update_settings(self):
-        tile = int(self.dict['chain']['dac']['tile'])
-        ch = int(self.dict['chain']['dac']['ch'])
-        m_set = self.soc.rf.dac_tiles[tile].blocks[ch].MixerSettings
+        # Read from the RFDC cache (no hardware read-back).
+        blockid = self.dict['chain']['dac']['id']
+        m_set = self.soc.rf.get_mixer_settings(blockid, 'dac')
         self.dict['mixer'] = {
-            'mode'     : self.return_key(self.mixer_dict['mode'], m_set['MixerMode']),
-            'type'     : self.return_key(self.mixer_dict['type'], m_set['MixerType']),
-            'evnt_src' : self.return_key(self.event_dict['source'], m_set['EventSource']),
+            'mode'     : self.mixer_lut['mode'].get(m_set['MixerMode'], 'Key Not Found'),
+            'type'     : self.mixer_lut['type'].get(m_set['MixerType'], 'Key Not Found'),
+            'evnt_src' : self.event_lut['source'].get(m_set['EventSource'], 'Key Not Found'),
             'freq'     : m_set['Freq'],
         }
         
-        self.dict['nqz'] = self.soc.rf.dac_tiles[tile].blocks[ch].NyquistZone        
+        self.dict['nqz'] = self.soc.rf.get_nyquist(blockid, 'dac')
         
     def set_mixer_frequency(self, f):
         if self.dict['mixer']['type'] != 'fine':
@@ -509,8 +629,8 @@ class DualChain():
     def get_bin_pfb(self, f=0, verbose=False):
         return self.analysis.get_bin_pfb(f=f, verbose=verbose)
 
-    def get_bin_xfft(self, f=0, verbose=False):
-        return self.analysis.get_bin_xfft(f=f, verbose=verbose)
+    def get_bin_xfft(self, f=0, verbose=False, out=None):
+        return self.analysis.get_bin_xfft(f=f, verbose=verbose, out=out)
 
     def get_data_acc(self, N=1, verbose=False):
         return self.analysis.get_data_acc(N=N, verbose=verbose)
@@ -533,17 +653,30 @@ class DualChain():
 
 class TopSoc(Overlay, QickConfig):    
 
+    # Chain configuration entries stored in the HWH topology cache.
+    TOPO_KEYS = ['analysis', 'synthesis']
+
     # Constructor.
-    def __init__(self, bitfile, force_init_clks=False, ignore_version=True, **kwargs):
+    def __init__(self, bitfile, force_init_clks=False, ignore_version=True, hwh_cache=None, profile=False, **kwargs):
         """
         Constructor method
+
+        :param hwh_cache: directory of the persistent HWH topology cache (see HwhCache), or None to disable it.
+        :type hwh_cache: str
+        :param profile: record the startup time per phase and per IP driver constructor (see self.profiler).
+        :type profile: bool
         """
 
         self.external_clk = False
         self.clk_output = False
 
+        # Startup profiler.
+        self.profiler = StartupProfiler(enabled=profile)
+        self.profiler.start()
+
         # Load bitstream.
-        Overlay.__init__(self, bitfile, ignore_version=ignore_version, download=False, **kwargs)
+        with self.profiler.section('Overlay.__init__'):
+            Overlay.__init__(self, bitfile, ignore_version=ignore_version, download=False, **kwargs)
 
         # Initialize the configuration
         self._cfg = {}
@@ -551,23 +684,39 @@ class TopSoc(Overlay, QickConfig):
         self['board'] = os.environ["BOARD"]
 
         # Read the config to get a list of enabled ADCs and DACs, and the sampling frequencies.
-        self.list_rf_blocks(
-            self.ip_dict['usp_rf_data_converter_0']['parameters'])
+        with self.profiler.section('list_rf_blocks'):
+            self.list_rf_blocks(
+                self.ip_dict['usp_rf_data_converter_0']['parameters'])
 
-        self.config_clocks(force_init_clks)
+        with self.profiler.section('config_clocks'):
+            self.config_clocks(force_init_clks)
 
         # RF data converter (for configuring ADCs and DACs, and setting NCOs)
-        self.rf = self.usp_rf_data_converter_0
-        self.rf.configure(self)
+        with self.profiler.section('rfdc'):
+            self.rf = self.usp_rf_data_converter_0
+            self.rf.configure(self)
 
         # Extract the IP connectivity information from the HWH parser and metadata.
-        self.metadata = QickMetadata(self)
+        with self.profiler.section('QickMetadata'):
+            cache = None if hwh_cache is None else HwhCache(hwh_cache)
+            self.metadata = QickMetadata(self, cache)
+
+        with self.profiler.section('map_signal_paths'):
+            self.map_signal_paths(self.metadata.cached)
 
-        self.map_signal_paths()
+        # Store the topology for the next start.
+        if cache is not None and self.metadata.cached is None:
+            cache.save(self.metadata.key, {
+                'timestamp'     : self.metadata.timestamp,
+                'metadata'      : self.metadata.tables(),
+                'connections'   : self.connections,
+                'cfg'           : {k : self[k] for k in self.TOPO_KEYS}})
 
         # Add XFFT order manually.
         self.FFT_N = 32768
 
+        self.profiler.stop()
+
     def description(self):
         """Generate a printable description of the QICK configuration.
 
@@ -595,11 +744,17 @@ class TopSoc(Overlay, QickConfig):
                 #lines.append("\t\tXFFT
         return "\nBREAD configuration:\n"+"\n".join(lines)
 
-    def map_signal_paths(self):
+    def map_signal_paths(self, topo=None):
         # Use the HWH parser to trace connectivity and deduce the channel numbering.
+        # With a cached topology the traced connections are restored instead.
+        self.connections = {}
         for key, val in self.ip_dict.items():
             if hasattr(val['driver'], 'configure_connections'):
-                getattr(self, key).configure_connections(self)
+                if topo is None:
+                    self.connections[key] = getattr(self, key).trace_connections(self)
+                else:
+                    self.connections[key] = topo['connections'][key]
+                    getattr(self, key).restore_connections(self, self.connections[key])
 
         # PFB for Analysis.
         self.pfbs_in = []
@@ -645,10 +800,17 @@ class TopSoc(Overlay, QickConfig):
             if pfb.HAS_ACCUMULATOR:
                 block = getattr(self, pfb.dict['accumulator'])
                 dma = getattr(self, pfb.dict['dma'])
-                block.configure(dma)
+                block.configure(dma, fs=pfb.dict['freq']['fb'])
 
         self['adcs'] = list(self.adcs.keys())
         self['dacs'] = list(self.dacs.keys())
+
+        # Chain configuration from cache.
+        if topo is not None:
+            for k in self.TOPO_KEYS:
+                self[k] = topo['cfg'][k]
+            return
+
         self['analysis'] = []
         self['synthesis'] = []
         for pfb in self.pfbs_in:
@@ -686,12 +848,16 @@ class TopSoc(Overlay, QickConfig):
     def config_clocks(self, force_init_clks):
         """
         Configure PLLs if requested, or if any ADC/DAC is not locked.
+        If the PL already holds this exact bitstream (see bitstream_loaded) and all PLLs are locked, e.g. when
+        reconnecting to a board configured by a previous session, nothing is downloaded.
         """
               
         # if we're changing the clock config, we must set the clocks to apply the config
         if force_init_clks:
             self.set_all_clks()
             self.download()
+        elif self.bitstream_loaded() and self.clocks_locked():
+            return
         else:
             self.download()
             if not self.clocks_locked():
@@ -701,6 +867,32 @@ class TopSoc(Overlay, QickConfig):
             print(
                 "Not all DAC and ADC PLLs are locked. You may want to repeat the initialization of the QickSoc.")
 
+    def bitstream_loaded(self):
+        """
+        Checks whether the PL holds this bitstream, comparing the bitfile name and content hash with the ones
+        pynq recorded in its global state when the PL was last programmed. This does not rely on the Overlay
+        timestamp, which can be empty with download=False.
+        Without a recorded hash (pynq older than 3.0, or no bitstream downloaded since boot) it returns False,
+        so the bitstream is downloaded.
+
+        :return: True if the loaded bitstream is this one.
+        :rtype: bool
+        """
+        try:
+            from pynq.pl_server.global_state import global_state_file_exists, load_global_state, bitstream_hash
+        except ImportError:
+            return False
+
+        if not global_state_file_exists():
+            return False
+
+        state = load_global_state()
+        if os.path.basename(state.bitfile_name) != os.path.basename(self.bitfile_name):
+            return False
+
+        loaded_hash = getattr(state, 'bitfile_hash', None)
+        return loaded_hash is not None and loaded_hash == bitstream_hash(self.bitfile_name)
+
     def set_all_clks(self):
         """
         Resets all the board clocks